@@ -0,0 +1,155 @@
+'''
+awaitable lookups in StarDict dictionaries
+
+AsyncStarDict runs searches and reads of a dictionary on an executor
+with a limit of them running at once for that dictionary. Identical
+requests in flight share one job, so a burst of the same query reads
+the disk once, and requests given a channel replace the previous
+request of that channel (e.g. search as you type), the older one is
+cancelled and its caller gets Superseded.
+'''
+import asyncio
+import functools
+
+import stardict as sdict
+
+
+class Superseded(Exception):
+    'a newer request of the same channel replaced this one'
+
+
+class Limiter:
+    '''
+    runs blocking functions on executor (default executor of
+    the running loop when None), at most limit of them at once
+    '''
+    def __init__(self, limit, executor=None):
+        self.limit = limit
+        self.executor = executor
+        self.slots = None
+
+    async def run(self, fn, *args):
+        if self.slots is None:
+            # created in the running loop
+            self.slots = asyncio.Semaphore(self.limit)
+        async with self.slots:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+
+class AsyncStarDict:
+    '''
+    asyncio facade of StarDict d (or .ifo path, loaded on first use),
+    at most limit jobs of it run at once on executor (default
+    executor of the loop when None)
+    '''
+    def __init__(self, d, limit=4, executor=None):
+        if isinstance(d, str):
+            d = sdict.StarDict(d, False)
+        self.d = d
+        self.limit = limit
+        self.executor = executor
+        self._limiter = Limiter(limit, executor)
+        self._inflight = {}
+        self._channels = {}
+
+    async def _run(self, fn, *args):
+        return await self._limiter.run(fn, *args)
+
+    def _done(self, key, shared, fut):
+        if self._inflight.get(key) is shared:
+            del self._inflight[key]
+        if not fut.cancelled():
+            # nobody may be waiting any more
+            fut.exception()
+
+    async def _call(self, key, fn, *args):
+        '''
+        result of fn(*args) run on the executor, callers with
+        the same key meanwhile share it; the job is cancelled
+        (if it hasn't started yet) when all of them are
+        '''
+        shared = self._inflight.get(key)
+        if shared is None:
+            fut = asyncio.ensure_future(self._run(fn, *args))
+            shared = self._inflight[key] = [fut, 0]
+            fut.add_done_callback(functools.partial(self._done, key, shared))
+        fut = shared[0]
+        shared[1] += 1
+        try:
+            return await asyncio.shield(fut)
+        finally:
+            shared[1] -= 1
+            if not shared[1] and not fut.done():
+                fut.cancel()
+
+    async def _latest(self, channel, coro):
+        'awaits coro, cancelling the previous one of channel'
+        if channel is None:
+            return await coro
+        task = asyncio.ensure_future(coro)
+        old = self._channels.get(channel)
+        self._channels[channel] = task
+        if old is not None and not old.done():
+            old.cancel()
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if self._channels.get(channel) is not task and task.cancelled():
+                raise Superseded(channel) from None
+            raise
+        finally:
+            if self._channels.get(channel) is task:
+                del self._channels[channel]
+
+    async def load(self):
+        if not self.d.loaded:
+            await self._call(('load',), self.d.load)
+
+    async def search(self, word, prefix=False, channel=None):
+        'index of word, see StarDict.search'
+        await self.load()
+        return await self._latest(channel, self._call(('search', word, prefix),
+                                                      self.d.search, word, prefix))
+
+    def _lookup(self, word, prefix):
+        i = self.d.search(word, prefix)
+        return (i, self.d.dict_data(i)) if i >= 0 else None
+
+    async def lookup(self, word, prefix=False, channel=None):
+        '(index, translation) of word, None when it is missing'
+        await self.load()
+        return await self._latest(channel, self._call(('lookup', word, prefix),
+                                                      self._lookup, word, prefix))
+
+    async def dict_data(self, index):
+        await self.load()
+        return await self._call(('data', index), self.d.dict_data, index)
+
+    async def lookup_many(self, words, prefix=False, channel=None):
+        'see StarDict.lookup_many, all words are one job'
+        await self.load()
+        words = tuple(words)
+        return await self._latest(channel, self._call(('many', words, prefix),
+                                                      self.d.lookup_many, words, prefix))
+
+    def __len__(self):
+        return len(self.d)
+
+    def __getitem__(self, key):
+        return self.d[key]
+
+
+if __name__ == '__main__':
+
+    async def demo():
+        ad = AsyncStarDict(sdict.look_for_dicts('./dic')[0])
+        # the same lookups share one read
+        hits = await asyncio.gather(*[ad.lookup('hello', True) for n in range(10)])
+        print(ad[hits[0][0]], hits[0][1][:60])
+        # typing replaces older searches of the channel
+        found = await asyncio.gather(*[ad.search(w, True, channel='entry')
+                                       for w in ('h', 'he', 'hel')],
+                                     return_exceptions=True)
+        print(found)
+
+    asyncio.run(demo())
@@ -0,0 +1,325 @@
+'''
+benchmarks of StarDict reading on synthetic dictionaries
+
+    python bench.py --entries 10000 1000000 --out results.json
+
+generates dictionaries with the given numbers of entries (kept in
+--dir and reused by later runs with the same parameters) and measures
+loading of the index (cold: without index caches, warm: with them)
+including peak memory, exact and prefix search latency, random and
+sequential dict_data throughput, reads crossing chunks of .dict.dz and
+random reads of uncompressed .dict by positional reads and by views of
+the mapped file; results are printed (or written) as JSON so runs can
+be compared. Dictionaries over 4 GiB need --offsetbits 64, e.g.
+
+    python bench.py --entries 50000 --formats dict --def-len 80000 120000 --offsetbits 64
+'''
+import os
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+
+import stardict as sdict
+import writer
+import metrics
+
+_letters = 'abcdefghijklmnopqrstuvwxyz'
+_extra = 'áčďéěíňóřšťúůýž'
+_text = ('house home book word dictionary translation meaning sense use '
+         'noun verb adjective example phrase old new big small').split()
+
+
+def _word(i, width, rnd):
+    '''
+    i-th word, a fixed width base-26 prefix keeps words unique
+    and sorted, a random tail of various length makes them look real
+    '''
+    prefix = []
+    for n in range(width):
+        i, r = divmod(i, 26)
+        prefix.append(_letters[r])
+    tail = ''.join(rnd.choice(_letters+_extra) for n in range(rnd.randint(0, 8)))
+    return ''.join(reversed(prefix)) + tail
+
+
+def _definition(rnd, length):
+    words = []
+    size = 0
+    # long ones repeat their first 1000 characters, they're made faster
+    while size < min(length, 1000):
+        w = rnd.choice(_text)
+        words.append(w)
+        size += len(w)+1
+    text = ' '.join(words[1:])
+    if size < length:
+        text = ((text+' ')*(length//size+1))[:length-len(words[0])-8]
+    return '<b>'+words[0]+'</b> '+text
+
+
+def generate(path, entries, compress=True, chunk_size=58315,
+             deflen=(20, 400), seed=1, offsetbits=32):
+    '''
+    writes synthetic dictionary path.ifo, .idx and .dict or .dict.dz,
+    definitions have deflen[0] to deflen[1] characters
+    '''
+    rnd = random.Random(seed)
+    width = 1
+    while 26**width < entries:
+        width += 1
+    with writer.Writer(path, 'synthetic %d' % entries, compress,
+                       offsetbits=offsetbits, chunk_size=chunk_size) as w:
+        for i in range(entries):
+            w.add(_word(i, width, rnd), _definition(rnd, rnd.randint(*deflen)))
+    return path+'.ifo'
+
+
+def _remove_caches(ifo):
+    name = ifo[:-4]
+    for ext in ('.idxcache', '.syncache', '.idx.oft'):
+        if os.path.exists(name+ext):
+            os.remove(name+ext)
+
+
+def _percentiles(times):
+    times = sorted(times)
+    pick = lambda p: times[min(len(times)-1, int(p*len(times)))]*1e6
+    return {'p50_us': pick(.5), 'p90_us': pick(.9), 'p99_us': pick(.99),
+            'max_us': times[-1]*1e6, 'count': len(times)}
+
+
+def _maxrss():
+    'peak resident memory of this process in bytes'
+    # ru_maxrss survives exec on Linux, it could be the parent's peak
+    try:
+        with open('/proc/self/status') as f:
+            for l in f:
+                if l.startswith('VmHWM:'):
+                    return int(l.split()[1])*1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return rss if sys.platform == 'darwin' else rss*1024
+
+
+def measure_load(ifo, index):
+    'run in a separate process, so its peak memory is of the load only'
+    rss0 = _maxrss()
+    t = time.perf_counter()
+    sdict.StarDict(ifo, index=index)
+    elapsed = time.perf_counter()-t
+    rss = _maxrss()
+    return {'seconds': elapsed, 'peak_rss': rss,
+            'peak_rss_delta': rss-rss0 if rss is not None else None}
+
+
+def _load_in_child(ifo, index):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child-load', ifo, index],
+                         stdout=subprocess.PIPE, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(out.stdout.decode('utf8').splitlines()[-1])
+
+
+def bench_load(ifo, index):
+    _remove_caches(ifo)
+    cold = _load_in_child(ifo, index)
+    warm = _load_in_child(ifo, index)
+    return {'cold': cold, 'warm': warm}
+
+
+def bench_search(d, queries, rnd):
+    words = [d[rnd.randrange(len(d))] for n in range(queries)]
+    prefixes = [w[:rnd.randint(1, len(w))] for w in words]
+    # a quarter of the exact queries misses
+    exact = [w+'#' if n % 4 == 0 else w for n, w in enumerate(words)]
+    out = {}
+    for name, qs, prefix in (('exact', exact, False), ('prefix', prefixes, True)):
+        times = []
+        for q in qs:
+            t = time.perf_counter()
+            d.search(q, prefix)
+            times.append(time.perf_counter()-t)
+        out[name] = _percentiles(times)
+    return out
+
+
+def _throughput(d, indexes):
+    size = 0
+    t = time.perf_counter()
+    for i in indexes:
+        size += len(d.dict_data(i))
+    elapsed = time.perf_counter()-t
+    return {'entries_per_s': len(indexes)/elapsed, 'mb_per_s': size/elapsed/1e6,
+            'seconds': elapsed, 'count': len(indexes)}
+
+
+def bench_data(d, reads, rnd):
+    start = rnd.randrange(max(1, len(d)-reads))
+    sequential = range(start, min(len(d), start+reads))
+    randoms = [rnd.randrange(len(d)) for n in range(reads)]
+    dz = d.dictf if isinstance(d.dictf, sdict.DictZip) else None
+    out = {}
+    for name, indexes in (('sequential', sequential), ('random', randoms)):
+        # each pass starts with an empty chunk cache
+        if dz is not None:
+            dz.cache_clear()
+        out[name] = _throughput(d, indexes)
+        if dz is not None:
+            out[name]['cache'] = dz.cache_info()
+    return out
+
+
+def bench_chunks(d, reads, rnd):
+    'reads of translations crossing chunk boundaries, cold and cached'
+    dz = d.dictf
+    if not isinstance(dz, sdict.DictZip):
+        return None
+    crossing = []
+    for n in range(reads*20):
+        i = rnd.randrange(len(d))
+        offset, size = d.dict_link(i)
+        if offset//dz.chlen != (offset+size-1)//dz.chlen:
+            crossing.append(i)
+            if len(crossing) >= reads:
+                break
+    if not crossing:
+        return {'count': 0}
+    cold, warm = [], []
+    for i in crossing:
+        dz.cache_clear()
+        t = time.perf_counter()
+        d.dict_data(i)
+        cold.append(time.perf_counter()-t)
+        t = time.perf_counter()
+        d.dict_data(i)
+        warm.append(time.perf_counter()-t)
+    return {'cold': _percentiles(cold), 'cached': _percentiles(warm)}
+
+
+def bench_dictzip(d, reads, rnd):
+    'raw DictZip.read of random ranges'
+    dz = d.dictf
+    if not isinstance(dz, sdict.DictZip):
+        return None
+    total = dz.chlen*dz.chcnt
+    times = []
+    for n in range(reads):
+        dz.seek(rnd.randrange(max(1, total-4096)))
+        t = time.perf_counter()
+        dz.read(rnd.randint(16, 4096))
+        times.append(time.perf_counter()-t)
+    return _percentiles(times)
+
+
+def bench_readers(d, reads, rnd):
+    '''
+    random reads of uncompressed .dict: positional reads copying
+    into bytes (DictFile), slices of the mapped file copied into
+    bytes (DictMmap.pread) and views of it without copying
+    (DictMmap.view); one untimed pass warms the page cache first
+    '''
+    if not isinstance(d.dictf, sdict.DictFile):
+        return None
+    links = [d.dict_link(rnd.randrange(len(d))) for n in range(reads)]
+    name = d.fname+'.dict'
+    out = {'dict_bytes': os.path.getsize(name)}
+    with open(name, 'rb') as f:
+        for offset, size in links:
+            f.seek(offset)
+            f.read(size)
+    plain, mapped = sdict.DictFile(name), sdict.DictMmap(name)
+    for kind, read in (('pread', plain.pread), ('mmap_copy', mapped.pread),
+                       ('mmap_view', mapped.view)):
+        times = []
+        total = 0
+        for offset, size in links:
+            t = time.perf_counter()
+            data = read(offset, size)
+            times.append(time.perf_counter()-t)
+            total += len(data)
+        del data
+        out[kind] = _percentiles(times)
+        out[kind]['mb_per_s'] = total/sum(times)/1e6
+    plain.close()
+    mapped.close()
+    return out
+
+
+def run(args):
+    os.makedirs(args.dir, exist_ok=True)
+    results = {'python': platform.python_version(), 'platform': platform.platform(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'params': vars(args), 'runs': []}
+    for entries in args.entries:
+        for fmt in args.formats:
+            name = 'syn-%d-%s-%d-%d-%d' % (entries, fmt, args.chunk_size, *args.def_len)
+            if args.offsetbits != 32:
+                name += '-%d' % args.offsetbits
+            path = os.path.join(args.dir, name)
+            if not os.path.exists(path+'.ifo'):
+                print('generating', name, file=sys.stderr)
+                generate(path, entries, fmt == 'dz', args.chunk_size, tuple(args.def_len),
+                         args.seed, args.offsetbits)
+            ifo = path+'.ifo'
+            for index in args.index:
+                print('measuring', name, index, file=sys.stderr)
+                rnd = random.Random(args.seed)
+                run = {'entries': entries, 'format': fmt, 'index': index,
+                       'idx_bytes': os.path.getsize(path+'.idx'),
+                       'load': bench_load(ifo, index)}
+                metrics.reset()
+                d = sdict.StarDict(ifo, index=index)
+                run['search'] = bench_search(d, args.queries, rnd)
+                run['dict_data'] = bench_data(d, args.reads, rnd)
+                run['chunk_boundary'] = bench_chunks(d, args.reads, rnd)
+                run['dictzip_read'] = bench_dictzip(d, args.reads, rnd)
+                run['dict_read'] = bench_readers(d, args.reads, rnd)
+                if metrics.enabled:
+                    run['metrics'] = metrics.snapshot()
+                d.unload()
+                gc.collect()
+                results['runs'].append(run)
+    return results
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument('--entries', type=int, nargs='+', default=[10000, 100000])
+    p.add_argument('--formats', nargs='+', choices=('dz', 'dict'), default=['dz', 'dict'])
+    p.add_argument('--index', nargs='+', choices=sorted(sdict.StarDict.index_types),
+                   default=['mmap'])
+    p.add_argument('--chunk-size', type=int, default=58315)
+    p.add_argument('--offsetbits', type=int, choices=(32, 64), default=32,
+                   help='idxoffsetbits of generated dictionaries')
+    p.add_argument('--def-len', type=int, nargs=2, default=[20, 400], metavar=('MIN', 'MAX'))
+    p.add_argument('--queries', type=int, default=2000)
+    p.add_argument('--reads', type=int, default=2000)
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--dir', default=os.path.join(sdict.default_cache_dir(), 'bench'))
+    p.add_argument('--out', help='JSON file, stdout by default')
+    p.add_argument('--metrics', action='store_true',
+                   help='collect metrics (see metrics.py) of every run')
+    p.add_argument('--child-load', nargs=2, help=argparse.SUPPRESS)
+    args = p.parse_args(argv)
+
+    if args.child_load:
+        print(json.dumps(measure_load(*args.child_load)))
+        return
+    metrics.enable(args.metrics)
+    results = run(args)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+'''
+persistent catalog of dictionaries found in directory trees
+
+Walking a big (or network) directory tree with look_for_dicts() and
+parsing every .ifo takes long, so Catalog keeps what was found in a
+file in the user cache directory and gives it at once on the next
+start. rescan() (or refresh() on a background thread) then brings
+it up to date: a directory is listed again only when its mtime
+changed (files or subdirectories were added or removed) and .ifo
+files are parsed again only when they changed, directories are
+visited by a pool of threads in parallel.
+'''
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import stardict as sdict
+
+
+class Catalog:
+    '''
+    dictionaries in directory trees roots (one path or a list),
+    the catalog is stored in file path, by default in
+    stardict.default_cache_dir() under a name unique for roots
+    '''
+    version = 1
+
+    def __init__(self, roots, path=None, workers=8):
+        if isinstance(roots, str):
+            roots = [roots]
+        self.roots = [os.path.abspath(r) for r in roots]
+        if path is None:
+            digest = hashlib.sha1('\0'.join(self.roots).encode('utf8')).hexdigest()
+            path = os.path.join(sdict.default_cache_dir(), 'catalog-'+digest[:16]+'.json')
+        self.path = path
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.thread = None
+        self.changed = False
+        self.dirs = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != self.version or data.get('roots') != self.roots:
+            return None
+        return data['dirs']
+
+    def _save(self, dirs):
+        data = json.dumps({'version': self.version, 'roots': self.roots, 'dirs': dirs})
+        return sdict.atomic_write(self.path, lambda f: f.write(data.encode('utf8')))
+
+    def dicts(self):
+        '''
+        list of (.ifo path, parsed .ifo) of all dictionaries, from
+        the stored catalog when there is one, otherwise scanned now
+        '''
+        if self.dirs is None:
+            self.rescan()
+            # nothing to report, this is the first list
+            self.changed = False
+        with self.lock:
+            dirs = self.dirs
+        found = [(d['ifo'], d['info']) for rec in dirs.values() for d in rec['dicts']]
+        return sorted(found)
+
+    def stardicts(self, **kw):
+        '''
+        unloaded StarDict objects of all dictionaries, keyword
+        arguments go to StarDict; unsupported ones are left out
+        '''
+        out = []
+        for ifo, info in self.dicts():
+            try:
+                out.append(sdict.StarDict(ifo, False, ifo=info, **kw))
+            except ValueError:
+                print('Could NOT load', ifo)
+        return out
+
+    @staticmethod
+    def _dict(ifo, old):
+        'catalog entry of .ifo, the old one when the file is the same'
+        st = os.stat(ifo)
+        if old is not None and old['mtime'] == st.st_mtime_ns and old['size'] == st.st_size:
+            return old
+        return {'ifo': ifo, 'mtime': st.st_mtime_ns, 'size': st.st_size,
+                'info': sdict.read_ifo(ifo)}
+
+    def _scan_dir(self, path, old):
+        '''
+        record of directory path: its mtime, subdirectories
+        and dictionaries; None when it can't be read
+        '''
+        try:
+            st = os.stat(path)
+            olddicts = {d['ifo']: d for d in old['dicts']} if old else {}
+            if old is not None and old['mtime'] == st.st_mtime_ns:
+                # the same entries, only .ifo files may have changed
+                subdirs = old['subdirs']
+                ifos = list(olddicts)
+            else:
+                subdirs, files = [], set()
+                with os.scandir(path) as it:
+                    for e in it:
+                        if e.is_dir(follow_symlinks=False):
+                            subdirs.append(e.path)
+                        else:
+                            files.add(e.name)
+                ifos = []
+                for f in sorted(files):
+                    name = f[:-4]
+                    if (f.endswith('.ifo') and name+'.idx' in files and
+                            (name+'.dict.dz' in files or name+'.dict' in files)):
+                        ifos.append(os.path.join(path, f))
+            dicts = []
+            for ifo in ifos:
+                try:
+                    dicts.append(self._dict(ifo, olddicts.get(ifo)))
+                except (OSError, UnicodeDecodeError):
+                    pass
+        except OSError:
+            return None
+        return {'mtime': st.st_mtime_ns, 'subdirs': subdirs, 'dicts': dicts}
+
+    def rescan(self):
+        '''
+        brings the catalog up to date and stores it,
+        returns True when anything changed
+        '''
+        with self.lock:
+            old = self.dirs or {}
+        dirs = {}
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='catalog') as pool:
+            pending = {pool.submit(self._scan_dir, r, old.get(r)): r for r in self.roots}
+            while pending:
+                done, rest = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    path = pending.pop(f)
+                    rec = f.result()
+                    if rec is None:
+                        continue
+                    dirs[path] = rec
+                    for sub in rec['subdirs']:
+                        if sub not in dirs:
+                            pending[pool.submit(self._scan_dir, sub, old.get(sub))] = sub
+        changed = dirs != old
+        with self.lock:
+            self.dirs = dirs
+            self.changed = self.changed or changed
+        if changed or not os.path.exists(self.path):
+            self._save(dirs)
+        return changed
+
+    def refresh(self):
+        '''
+        rescans on a background thread, `changed` is set when
+        it's done and found changes, see done()
+        '''
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.rescan, name='catalog', daemon=True)
+            self.thread.start()
+        return self.thread
+
+    def done(self):
+        'True when no background rescan is running'
+        return self.thread is None or not self.thread.is_alive()
+
+
+if __name__ == '__main__':
+
+    import sys
+    import time
+
+    t = time.time()
+    cat = Catalog(sys.argv[1:] or ['./dic'])
+    for ifo, info in cat.dicts():
+        print(info.get('bookname'), ifo)
+    print('%.3f s' % (time.time()-t))
+    print('changed' if cat.rescan() else 'up to date')
@@ -0,0 +1,131 @@
+'''
+more dictionaries searched together
+'''
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import stardict as sdict
+
+
+class DictionarySet:
+    '''
+    searches all its dictionaries at once, each of them on a worker
+    thread, and merges hits in the order of dictionaries;
+    dictionaries not answering within their timeout are left out
+    '''
+    def __init__(self, dicts, workers=None, timeout=0.5, timeouts=None):
+        '''
+        dicts are StarDict objects or .ifo paths as returned
+        by look_for_dicts(), the latter are opened without loading;
+        timeouts maps .ifo paths to seconds of those dictionaries,
+        the others have timeout
+        '''
+        self.dicts = []
+        for d in dicts:
+            if isinstance(d, str):
+                try:
+                    d = sdict.StarDict(d, False)
+                except ValueError:
+                    print('Could NOT load', d)
+                    continue
+            self.dicts.append(d)
+        self.timeout = timeout
+        timeouts = timeouts or {}
+        # seconds of each dictionary
+        self.timeouts = [timeouts.get(d.fname+'.ifo', timeout) for d in self.dicts]
+        self.pool = ThreadPoolExecutor(workers or max(len(self.dicts), 1),
+                                       thread_name_prefix='dictset')
+        self._locks = [threading.Lock() for d in self.dicts]
+
+    def __len__(self):
+        return len(self.dicts)
+
+    def __getitem__(self, num):
+        return self.dicts[num]
+
+    def _ensure_loaded(self, num):
+        with self._locks[num]:
+            if not self.dicts[num].loaded:
+                self.dicts[num].load()
+        return self.dicts[num]
+
+    def load(self):
+        'loads all dictionaries in parallel'
+        list(self.pool.map(self._ensure_loaded, range(len(self.dicts))))
+
+    def unload(self, keep=()):
+        'unloads all dictionaries except those in keep'
+        for num, d in enumerate(self.dicts):
+            with self._locks[num]:
+                if d.loaded and d not in keep:
+                    d.unload()
+
+    def _search(self, num, word, prefix, data):
+        d = self._ensure_loaded(num)
+        i = d.search(word, prefix)
+        if i < 0:
+            return None
+        return (d, i, d.dict_data(i)) if data else (d, i)
+
+    def submit(self, word, prefix=False, data=False):
+        'starts search in all dictionaries, returns list of futures'
+        return [self.pool.submit(self._search, num, word, prefix, data)
+                for num in range(len(self.dicts))]
+
+    def collect(self, futures, timeout=None, cancel=True):
+        '''
+        waits for futures from submit(), each at most the timeout of
+        its dictionary or timeout seconds when given, returns hits
+        of those which are done in dictionary order;
+        the others are cancelled unless cancel is False
+        '''
+        start = time.monotonic()
+        for f, limit in zip(futures, self.timeouts):
+            if timeout is not None:
+                limit = timeout
+            left = start+limit-time.monotonic()
+            if left > 0:
+                wait([f], left)
+        hits = []
+        for f in futures:
+            if f.done() and not f.cancelled() and f.exception() is None:
+                if f.result() is not None:
+                    hits.append(f.result())
+            elif cancel:
+                f.cancel()
+        return hits
+
+    def search(self, word, prefix=False, timeout=None):
+        'returns (dictionary, index) tuples of all hits'
+        return self.collect(self.submit(word, prefix), timeout)
+
+    def lookup(self, word, prefix=False, timeout=None):
+        'returns (dictionary, index, translation) tuples of all hits'
+        return self.collect(self.submit(word, prefix, True), timeout)
+
+    def close(self, keep=()):
+        '''
+        stops the workers, searches not started yet are cancelled,
+        and unloads dictionaries except those in keep; it's done on
+        a thread (which is returned) after the running searches end,
+        so the caller isn't blocked by them
+        '''
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        t = threading.Thread(target=self._close, args=(list(keep),),
+                             name='dictset close', daemon=True)
+        t.start()
+        return t
+
+    def _close(self, keep):
+        self.pool.shutdown(wait=True)
+        self.unload(keep)
+
+
+if __name__ == '__main__':
+
+    dset = DictionarySet(sdict.look_for_dicts('./dic'))
+    dset.load()
+    for d, i, text in dset.lookup('hello', True):
+        print(d.ifo['bookname'], d[i], text[:60])
+    dset.close().join()
@@ -0,0 +1,345 @@
+'''
+full text search in translations
+
+FullTextIndex.build() goes once through the whole .dict in order
+of positions of translations (so every chunk of .dict.dz is inflated
+only once), strips the markup, splits the text into words and writes
+an inverted index: for every word the entries containing it with
+positions of the word in them. Runs of postings are flushed to
+temporary files when they grow and merged at the end, so memory
+doesn't grow with the size of the dictionary.
+
+The index is then mapped, queries only read postings of their words
+and return ranked entry indexes, the .dict is not touched.
+'''
+import os
+import re
+import sys
+import math
+import html
+import heapq
+import mmap
+import shutil
+import struct
+import tempfile
+import bisect
+from array import array
+from collections import defaultdict
+
+import stardict as sdict
+
+_markup = re.compile(r'<[^>]*>')
+_word = re.compile(r'\w+')
+
+
+def tokenize(text):
+    'lowercased words of text, markup and entities removed'
+    return _word.findall(html.unescape(_markup.sub(' ', text)).lower())
+
+
+def _encode(values, out):
+    'appends values as varints to bytearray out'
+    for v in values:
+        while v > 0x7f:
+            out.append((v & 0x7f) | 0x80)
+            v >>= 7
+        out.append(v)
+
+
+def _decode(buf, pos, count):
+    'reads count varints from buf at pos, returns (values, new pos)'
+    values = []
+    for n in range(count):
+        v = shift = 0
+        while True:
+            b = buf[pos]
+            pos += 1
+            v |= (b & 0x7f) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        values.append(v)
+    return values, pos
+
+
+def _encode_postings(postings):
+    '''
+    postings are (entry, positions) sorted by entry, encoded as their
+    count and for each of them entry delta, number of positions
+    and position deltas
+    '''
+    out = bytearray()
+    _encode((len(postings),), out)
+    last = 0
+    for entry, positions in postings:
+        _encode((entry-last, len(positions)), out)
+        _encode([p-q for p, q in zip(positions, [0]+positions[:-1])], out)
+        last = entry
+    return out
+
+
+def _decode_postings(buf, pos=0):
+    (count,), pos = _decode(buf, pos, 1)
+    postings = []
+    entry = 0
+    for n in range(count):
+        (delta, npos), pos = _decode(buf, pos, 2)
+        entry += delta
+        deltas, pos = _decode(buf, pos, npos)
+        positions = []
+        p = 0
+        for d in deltas:
+            p += d
+            positions.append(p)
+        postings.append((entry, positions))
+    return postings
+
+
+# run file record: word and data lengths, then the word and data
+_RUN = struct.Struct('<II')
+
+
+def _write_run(postings, f):
+    'writes postings of a run sorted by words as lengths word data'
+    for word in sorted(postings):
+        data = _encode_postings(sorted(postings[word]))
+        w = word.encode('utf8')
+        f.write(_RUN.pack(len(w), len(data))+w+data)
+
+
+def _read_run(f):
+    'yields (word, postings data) from a run file'
+    while True:
+        head = f.read(_RUN.size)
+        if not head:
+            return
+        n, size = _RUN.unpack(head)
+        record = f.read(n+size)
+        yield record[:n].decode('utf8'), record[n:]
+
+
+class FullTextIndex:
+    '''
+    inverted index of words in translations of a dictionary,
+    kept in a file with extension .ftidx (see stardict.cache_path)
+    '''
+    ext     = '.ftidx'
+    magic   = b'PYSDFTX\0'
+    version = 1
+    # magic, version, .dict size, .dict mtime, entries, words,
+    # words data length, postings length
+    header  = struct.Struct('<8sHxxxxxxQqQQQQ')
+    # postings kept in memory before they are flushed to a run file
+    run_size = 2000000
+    # BM25 parameters
+    k1 = 1.2
+    b  = 0.75
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = open(path, 'rb')
+        header = self.fd.read(self.header.size)
+        if len(header) != self.header.size:
+            raise ValueError('broken full text index')
+        (magic, version, self.dict_size, self.dict_mtime, count, nwords,
+         wordslen, postlen) = self.header.unpack(header)
+        if magic != self.magic or version != self.version:
+            raise ValueError('unsupported full text index')
+        self.data = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        pos = self.header.size
+        sections = []
+        for code, n in (('I', count), ('I', nwords+1), ('Q', nwords+1)):
+            a = array(code)
+            a.frombytes(self.data[pos:pos+a.itemsize*n])
+            sections.append(a)
+            pos += a.itemsize*n
+        self.lengths, self.wstarts, self.poffsets = sections
+        self.wordbase = pos
+        self.postbase = pos+wordslen
+        self.avglen = sum(self.lengths)/max(count, 1)
+
+    @staticmethod
+    def _dict_stat(d):
+        name = d.fname+'.dict'
+        if not os.path.exists(name):
+            name += '.dz'
+        return os.stat(name)
+
+    @classmethod
+    def open(cls, d, cache=True, build=True):
+        '''
+        returns the index of StarDict d, it's (re)built when
+        missing or older than the dictionary and build is True
+        '''
+        path = sdict.cache_path(d.fname+'.idx', cls.ext, cache)
+        st = cls._dict_stat(d)
+        try:
+            index = cls(path)
+            if index.dict_size == st.st_size and index.dict_mtime == st.st_mtime_ns:
+                return index
+            index.close()
+        except (OSError, ValueError):
+            pass
+        if not build:
+            return None
+        cls.build(d, path)
+        return cls(path)
+
+    @classmethod
+    def build(cls, d, path):
+        'builds the index of loaded StarDict d and writes it to path'
+        st = cls._dict_stat(d)
+        tmpdir = tempfile.mkdtemp(prefix='ftidx', dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            runs = []
+            postings = defaultdict(list)
+            size = 0
+            lengths = array('I', bytes(4*len(d)))
+            for index, text in d.iter_data():
+                words = tokenize(text.decode('utf8', 'replace'))
+                lengths[index] = len(words)
+                positions = defaultdict(list)
+                for p, w in enumerate(words):
+                    positions[w].append(p)
+                for w, p in positions.items():
+                    postings[w].append((index, p))
+                size += len(words)
+                if size >= cls.run_size:
+                    runs.append(cls._flush(postings, tmpdir, len(runs)))
+                    postings = defaultdict(list)
+                    size = 0
+            runs.append(cls._flush(postings, tmpdir, len(runs)))
+            cls._merge(runs, lengths, st, path, tmpdir)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    @staticmethod
+    def _flush(postings, tmpdir, n):
+        name = os.path.join(tmpdir, 'run%d' % n)
+        with open(name, 'wb') as f:
+            _write_run(postings, f)
+        return name
+
+    @classmethod
+    def _merge(cls, runs, lengths, st, path, tmpdir):
+        'merges run files into the final index at path'
+        files = [open(r, 'rb') for r in runs]
+        words = bytearray()
+        wstarts = array('I', [0])
+        poffsets = array('Q', [0])
+        postname = os.path.join(tmpdir, 'postings')
+        try:
+            with open(postname, 'wb') as post:
+                merged = heapq.merge(*[_read_run(f) for f in files], key=lambda r: r[0])
+                word, parts = None, []
+                for w, data in merged:
+                    if w != word and parts:
+                        poffsets.append(poffsets[-1]+cls._write_word(post, parts))
+                        words += word.encode('utf8')
+                        wstarts.append(len(words))
+                        parts = []
+                    word = w
+                    parts.append(data)
+                if parts:
+                    poffsets.append(poffsets[-1]+cls._write_word(post, parts))
+                    words += word.encode('utf8')
+                    wstarts.append(len(words))
+        finally:
+            for f in files:
+                f.close()
+        def write(f):
+            f.write(cls.header.pack(cls.magic, cls.version, st.st_size, st.st_mtime_ns,
+                                    len(lengths), len(wstarts)-1, len(words),
+                                    poffsets[-1]))
+            for a in (lengths, wstarts, poffsets):
+                f.write(a.tobytes())
+            f.write(words)
+            with open(postname, 'rb') as post:
+                shutil.copyfileobj(post, f)
+        sdict.atomic_write(path, write, strict=True)
+
+    @staticmethod
+    def _write_word(post, parts):
+        'writes postings of one word from more runs, returns their length'
+        if len(parts) == 1:
+            data = parts[0]
+        else:
+            # runs were built from entries in .dict order, not in index order
+            postings = []
+            for p in parts:
+                postings += _decode_postings(p)
+            data = _encode_postings(sorted(postings))
+        post.write(data)
+        return len(data)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def _word(self, n):
+        a = self.wordbase
+        return self.data[a+self.wstarts[n]:a+self.wstarts[n+1]].decode('utf8')
+
+    def postings(self, word):
+        'list of (entry, positions) of entries containing word'
+        words = sdict._View(self._word, len(self.wstarts)-1)
+        n = bisect.bisect_left(words, word)
+        if n == len(words) or words[n] != word:
+            return []
+        a = self.postbase+self.poffsets[n]
+        b = self.postbase+self.poffsets[n+1]
+        return _decode_postings(self.data[a:b])
+
+    def search(self, query, mode='and', limit=None):
+        '''
+        entries whose translation contains words of query,
+        all of them ('and'), any of them ('or') or all of them
+        next to each other in that order ('phrase');
+        returns (index, score) tuples ranked by BM25 score
+        '''
+        words = tokenize(query)
+        if not words:
+            return []
+        if mode not in ('and', 'or', 'phrase'):
+            raise ValueError('unknown search mode: '+str(mode))
+        postings = {w: dict(self.postings(w)) for w in set(words)}
+        entries = [set(p) for p in postings.values()]
+        if mode == 'or':
+            found = set().union(*entries)
+        else:
+            found = set.intersection(*entries)
+        if mode == 'phrase' and len(words) > 1:
+            found = [e for e in found if self._has_phrase(e, words, postings)]
+        hits = [(e, self._score(e, postings)) for e in found]
+        hits.sort(key=lambda h: (-h[1], h[0]))
+        return hits[:limit] if limit is not None else hits
+
+    @staticmethod
+    def _has_phrase(entry, words, postings):
+        starts = set(postings[words[0]][entry])
+        for n, w in enumerate(words[1:], 1):
+            starts &= set(p-n for p in postings[w][entry])
+            if not starts:
+                return False
+        return True
+
+    def _score(self, entry, postings):
+        score = 0.0
+        norm = self.k1*(1-self.b+self.b*self.lengths[entry]/self.avglen)
+        for p in postings.values():
+            if entry in p:
+                idf = math.log((len(self)-len(p)+0.5)/(len(p)+0.5)+1)
+                tf = len(p[entry])
+                score += idf*tf*(self.k1+1)/(tf+norm)
+        return score
+
+    def close(self):
+        self.data.close()
+        self.fd.close()
+
+
+if __name__ == '__main__':
+
+    d = sdict.StarDict(sys.argv[1])
+    ft = FullTextIndex.open(d)
+    for i, score in ft.search(' '.join(sys.argv[2:]), limit=20):
+        print('%.2f' % score, d[i])
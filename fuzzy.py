@@ -0,0 +1,118 @@
+'''
+typo tolerant search of words
+
+sorted search keys of a dictionary index (see stardict.collation_key)
+form an implicit trie: words sharing a prefix are a continuous range
+found by galloping search from its start; the trie is walked with rows of Levenshtein distance
+matrix and branches which can't get within the distance are cut off,
+so no extra index has to be built and only a small part of words
+is ever looked at
+'''
+
+# ranges with at most this many words are compared word by word
+SMALL_RANGE = 16
+
+
+def _next_row(row, c, word, depth, maxdist):
+    '''
+    row of the distance matrix for one more letter c at depth;
+    only cells within maxdist of the diagonal can be in the distance,
+    the others are left at maxdist+1
+    '''
+    cap = maxdist+1
+    new = [cap]*len(row)
+    if depth <= maxdist:
+        new[0] = depth
+    for j in range(max(1, depth-maxdist), min(len(word), depth+maxdist)+1):
+        new[j] = min(row[j]+1, new[j-1]+1, row[j-1]+(c != word[j-1]), cap)
+    return new
+
+
+class FuzzySearch:
+    '''
+    finds words of an index (ListIndex, MmapIndex, OftIndex)
+    within maxdist edits of a word
+    '''
+    def __init__(self, idx):
+        self.idx = idx
+
+    def _key(self, i):
+        k = self.keys.get(i)
+        if k is None:
+            k = self.keys[i] = self.idx.key(i).decode('utf8', 'surrogateescape')
+        return k
+
+    def search(self, word, maxdist=None, limit=10):
+        '''
+        returns up to limit (index, distance) tuples of the closest
+        words, ordered by distance, then by length difference;
+        without maxdist words 1 edit away are searched and only
+        when there are none and word is longer than 4 letters
+        those 2 edits away, that is much more work
+        '''
+        if maxdist is None:
+            hits = self.search(word, 1, limit)
+            if hits or len(word) <= 4:
+                return hits
+            maxdist = 2
+        # search keys have only ASCII letters lowered
+        self.word = word.encode('utf8').lower().decode('utf8')
+        self.maxdist = maxdist
+        self.keys = {}
+        self.hits = []
+        row = [min(j, maxdist+1) for j in range(len(self.word)+1)]
+        self._walk('', row, 0, len(self.idx))
+        self.hits.sort(key=lambda h: (h[1], abs(len(self._key(h[0]))-len(self.word)), h[0]))
+        hits = self.hits[:limit]
+        self.keys = {}
+        self.hits = []
+        return hits
+
+    def _range_end(self, prefix, lo, hi):
+        '''
+        end of the range of words starting with prefix which begins at lo,
+        most ranges are short so they are found with a few probes
+        '''
+        key = self._key
+        step = 1
+        while lo+step < hi and key(lo+step).startswith(prefix):
+            lo += step
+            step *= 2
+        hi = min(lo+step, hi)
+        # key(lo) starts with prefix, key(hi) doesn't or it's the end
+        while hi-lo > 1:
+            mid = (lo+hi)//2
+            if key(mid).startswith(prefix):
+                lo = mid
+            else:
+                hi = mid
+        return hi
+
+    def _walk(self, prefix, row, lo, hi):
+        'visits words in [lo, hi) starting with prefix'
+        word, maxdist = self.word, self.maxdist
+        depth = len(prefix)
+        # the prefix itself is a word
+        while lo < hi and len(self._key(lo)) == depth:
+            if row[-1] <= maxdist:
+                self.hits.append((lo, row[-1]))
+            lo += 1
+        if hi-lo <= SMALL_RANGE:
+            # the rest of each word continues from the row of prefix
+            for i in range(lo, hi):
+                r = row
+                for d, c in enumerate(self._key(i)[depth:], depth+1):
+                    r = _next_row(r, c, word, d, maxdist)
+                    if min(r) > maxdist:
+                        break
+                else:
+                    if r[-1] <= maxdist:
+                        self.hits.append((i, r[-1]))
+            return
+        while lo < hi:
+            child = prefix + self._key(lo)[depth]
+            end = self._range_end(child, lo, hi)
+            new = _next_row(row, child[-1], word, depth+1, maxdist)
+            if min(new) <= maxdist:
+                self._walk(child, new, lo, end)
+            lo = end
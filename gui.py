@@ -6,6 +6,17 @@ except:
     import tkinter as tk
 
 from wordindex import WordIndexWindow, print_dir
+from dictset import DictionarySet
+from infix import InfixIndex, Matches
+from catalog import Catalog
+from pool import DictionaryPool
+from incremental import IncrementalSearch
+from render import RunCache
+from prefetch import Prefetcher
+import render
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metrics
 
 def show_dicts():
     global dicts
@@ -21,45 +32,155 @@ def show_dicts():
     textwin['wrap'] = tk.WORD
     textwin['state'] = tk.DISABLED
 
+def show_memory():
+    'resident sizes of dictionaries kept loaded'
+    textwin['state'] = tk.NORMAL
+    textwin.delete('1.0', tk.END)
+    textwin.insert(tk.END, 'loaded dictionaries (budget %d MB)\n' % (dpool.budget/1e6), '<small>')
+    for line in dpool.report():
+        textwin.insert(tk.END, line+'\n')
+    textwin['state'] = tk.DISABLED
+
 def on_dict_select(event):
     line = textwin.index('@%d,%d'%(event.x, event.y))
     line = int(float(line)) + 1
     change_dict(line/2-1)
 
 def change_dict(num):
-    global dict_active
+    global dict_active, infix_index, infix_build
     if not (0 <= num < len(dicts)):
         raise IndexError('dictionary index out of range')
-    dict_active.unload()
+    if matches is not None:
+        # the search must not hold the index being closed
+        matches.close()
+    if infix_index is not None:
+        infix_index.close()
+        infix_index = None
+    # an index being built is closed when it's done
+    infix_build = None
     dict_active = dicts[num]
-    dict_active.load()
+    if dset is None:
+        # the previous one stays loaded while it fits in the pool
+        dpool.use(dict_active, False)
+    start_loading(dict_active)
     root.wm_title(dict_active.ifo['bookname'])
     windex.rebind(dict_active) 
     wentry.delete(0, tk.END)
+
+def start_loading(d):
+    '''
+    loads d on a worker thread, it can be searched
+    meanwhile, progress is shown by poll_loading()
+    '''
+    if d.loaded:
+        statbar['text'] = d.ifo['bookname']
+        return
+    d.load_async()
+    poll_loading(d)
+
+def poll_loading(d):
+    if d is not dict_active or dset is not None:
+        return
+    if windex.items is d:
+        # words parsed so far
+        windex.refresh()
+    if not d.ready.is_set():
+        statbar['text'] = '%s: loading %d %%' % (d.ifo['bookname'], d.progress*100)
+        root.after(LOAD_POLL, poll_loading, d)
+        return
+    if d.load_error is not None:
+        statbar['text'] = 'Could NOT load %s: %s' % (d.ifo['bookname'], d.load_error)
+        return
+    statbar['text'] = d.ifo['bookname']
+    dpool.evict()
+    if wentry_sv.get():
+        # what was typed meanwhile may be further in the index
+        on_entry_change()
    
 def show_translation(index):
-    print("show_translation index:", index)
-    text = dict_active.dict_data(index)
-    print("show_translation text:", text)
-    #print text
+    t = metrics.start()
+    runs = rendered.get(dict_active, index)
     textwin['state'] = tk.NORMAL
     textwin.delete('1.0', tk.END)
-    textwin.insert('1.0', ' '+windex.items[index], 'head')
-    insert_formatted('\n'+text.decode())
+    render.insert(textwin, tk.END, (' '+dict_active[index], 'head', '\n', 'normal')+runs)
+    textwin['state'] = tk.DISABLED
+    metrics.stop('gui.show_translation', t)
+
+
+def toggle_all_dicts():
+    '''
+    switches between searching in the active dictionary
+    and in all of them at once
+    '''
+    global dset, pending
+    pending = None
+    if dset is None:
+        dset = DictionarySet(dicts)
+        statbar['text'] = 'all dictionaries'
+    else:
+        # unloaded on a thread once searches running now end
+        dset.close(keep=list(dpool.dicts.values())+[dict_active])
+        dset = None
+        dpool.use(dict_active, False)
+        start_loading(dict_active)
+    on_entry_change()
+
+def search_all(word):
+    '''
+    starts search in all dictionaries, its results
+    are picked up by poll_all() from Tk loop
+    '''
+    global pending
+    if pending is not None:
+        for f in pending:
+            f.cancel()
+    pending = dset.submit(word, True, True)
+    root.after(10, poll_all, pending, word, time.monotonic())
+
+def poll_all(futures, word, started, shown=False):
+    '''
+    shows hits once all dictionaries answered or, after their
+    timeouts (see DictionarySet), those found so far with the rest
+    marked as still searching; they are shown again when the rest answers
+    '''
+    global pending
+    if futures is not pending or dset is None:
+        # superseded by a newer search or single dictionary again
+        return
+    elapsed = time.monotonic()-started
+    late = [n for n, f in enumerate(futures) if not f.done()]
+    if late and (shown or any(elapsed < dset.timeouts[n] for n in late)):
+        root.after(10, poll_all, futures, word, started, shown)
+        return
+    hits = dset.collect(futures, 0, cancel=False)
+    if late:
+        root.after(10, poll_all, futures, word, started, True)
+    else:
+        pending = None
+    if not hits and not late:
+        wentry['fg'] = 'red'
+        wentry.red = True
+        return
+    for d, i, text in hits:
+        if d is dict_active:
+            windex.see(i)
+    show_translations(hits, [dset[n] for n in late])
+
+def show_translations(hits, late=()):
+    '''
+    shows translations found in more dictionaries,
+    late are those still being searched
+    '''
+    textwin['state'] = tk.NORMAL
+    textwin.delete('1.0', tk.END)
+    runs = ()
+    for d, i, text in hits:
+        runs += (d.ifo['bookname']+'\n', '<small>', ' '+d[i], 'head', '\n', 'normal')
+        runs += rendered.get(d, i, text)+('\n', 'normal')
+    for d in late:
+        runs += (d.ifo['bookname']+': still searching\n', '<small>')
+    render.insert(textwin, tk.END, runs)
     textwin['state'] = tk.DISABLED
-
-
-def insert_formatted(text):
-    chunks = text.split('<')
-    for ch in chunks:
-        tag = 'normal'
-        i_close = ch.find('>')
-        if ch[0] == '/' and i_close > 0:
-            ch = ch[i_close+1:]
-        elif i_close > 0:
-            tag = '<'+ch[:i_close+1]
-            ch = ch[i_close+1:]
-        textwin.insert(tk.END, ch, tag)
 
 
 def on_entry_change(*args):
@@ -72,18 +193,184 @@ def on_entry_change(*args):
     if word[0] == ':':
         # ':' opens command sequence, ignore it
         return
-    i = dict_active.search(word, True)
-    print("dict_active.search: word, i:", str(word), str(i))
+    if word[0] == '*':
+        # '*' lists words containing the rest
+        search_infix(word[1:])
+        return
+    if windex.items is not dict_active:
+        windex.rebind(dict_active)
+    if dset is not None:
+        debounce(search_all, word, word)
+        return
+    global searcher
+    metrics.count('gui.entry_changes')
+    if searcher is None or searcher.d is not dict_active:
+        searcher = IncrementalSearch(dict_active)
+    i = searcher.search(word)
     if i >= 0:
         windex.see(i)
-        show_translation(i)
+        prefetch_near(i)
+        debounce(show_translation, word, i)
+    else:
+        wentry['fg'] = 'red'
+        wentry.red = True
+        debounce(show_suggestions, word, word)
+
+def debounce(fn, word, *args):
+    '''
+    calls fn(*args) when typing pauses for DEBOUNCE milliseconds
+    and the entry still holds word, instead of the call
+    scheduled before
+    '''
+    global scheduled
+    if scheduled is not None:
+        root.after_cancel(scheduled)
+    scheduled = root.after(DEBOUNCE, run_debounced, fn, word, args)
+
+def run_debounced(fn, word, args):
+    global scheduled
+    scheduled = None
+    if wentry_sv.get() == word:
+        fn(*args)
+
+def when_done(future, fn, *args, failed=None):
+    '''
+    calls fn(result of future, *args) from Tk loop once it's done,
+    failed(exception, *args) instead when it raised
+    '''
+    if not future.done():
+        root.after(WORKER_POLL, lambda: when_done(future, fn, *args, failed=failed))
+        return
+    if future.cancelled():
+        return
+    e = future.exception()
+    if e is None:
+        fn(future.result(), *args)
+    elif failed is not None:
+        failed(e, *args)
+    else:
+        raise e
+
+def infix_failed(e, future):
+    global infix_build
+    if future is infix_build:
+        # the next '*' search tries again
+        infix_build = None
+        statbar['text'] = 'Could NOT index %s: %s' % (dict_active.ifo['bookname'], e)
+
+def infix_ready(index, future):
+    global infix_index, infix_build
+    if future is not infix_build:
+        # the dictionary changed meanwhile
+        index.close()
+        return
+    infix_build = None
+    infix_index = index
+    statbar['text'] = dict_active.ifo['bookname']
+    word = wentry_sv.get()
+    if word[:1] == '*':
+        search_infix(word[1:])
+
+def search_infix(text):
+    '''
+    lists words containing text in the word index, the first
+    page at once, more when it's scrolled to their end (see
+    more_matches); the index is built on worker first when needed
+    '''
+    global matches, infix_build
+    if not text:
+        return
+    if infix_index is None:
+        if not dict_active.loaded:
+            # poll_loading() searches again once it's loaded
+            return
+        if infix_build is None:
+            infix_build = worker.submit(InfixIndex.open, dict_active)
+            statbar['text'] = '%s: indexing words' % dict_active.ifo['bookname']
+            when_done(infix_build, infix_ready, infix_build, failed=infix_failed)
+        return
+    if matches is not None:
+        matches.close()
+    matches = Matches(dict_active, infix_index.iter_search(text))
+    matches.fetch(INFIX_PAGE)
+    windex.rebind(matches)
+    if len(matches):
+        show_translation(matches.indexes[0])
     else:
         wentry['fg'] = 'red'
         wentry.red = True
 
+def more_matches():
+    'fetches another page of words found when the word index shows their end'
+    m = windex.items
+    if m is not matches or m.done:
+        return
+    m.fetch(INFIX_PAGE)
+    windex.refresh()
+
+def sort_dicts(ds):
+    return sorted(ds, key=lambda d:d.ifo['bookname']+d.ifo['wordcount'])
+
+def poll_catalog(catalog):
+    'takes dictionaries found by the background rescan of catalog'
+    global dicts
+    if not catalog.done():
+        root.after(500, poll_catalog, catalog)
+        return
+    if not catalog.changed:
+        return
+    catalog.changed = False
+    # dictionaries already open (and maybe loaded) are kept
+    known = {d.fname: d for d in dicts}
+    dicts = sort_dicts(known.get(d.fname, d) for d in catalog.stardicts())
+
+def dict_index(n):
+    'index in dictionary of n-th item of the word index'
+    if isinstance(windex.items, Matches):
+        return windex.items.indexes[n]
+    return n
+
+def find_similar(d, word):
+    'words of d similar to word, run on worker'
+    return [d[i] for i, dist in d.fuzzy_search(word)]
+
+def show_suggestions(word):
+    'offers words similar to the one not found, looked for on worker'
+    global suggesting
+    if suggesting is not None:
+        suggesting.cancel()
+    suggesting = worker.submit(find_similar, dict_active, word)
+    when_done(suggesting, suggestions_found, word, dict_active)
+
+def suggestions_found(found, word, d):
+    global suggestions
+    if d is not dict_active or wentry_sv.get() != word:
+        # typing went on meanwhile
+        return
+    suggestions = found
+    textwin['state'] = tk.NORMAL
+    textwin.delete('1.0', tk.END)
+    if suggestions:
+        textwin.insert(tk.END, 'did you mean\n', '<small>')
+    for w in suggestions:
+        textwin.insert(tk.END, w, '<sugg>')
+        textwin.insert(tk.END, '\n')
+    textwin['state'] = tk.DISABLED
+
+def on_sugg_select(event):
+    line = int(float(textwin.index('@%d,%d'%(event.x, event.y))))
+    if 2 <= line < len(suggestions)+2:
+        wentry_sv.set(suggestions[line-2])
+        wentry.icursor(tk.END)
+
 def command_eval(word):
     if word == ':d':
         show_dicts()
+    elif word == ':m':
+        show_memory()
+    elif word == ':a':
+        wentry.delete(0, tk.END)
+        toggle_all_dicts()
     elif word.startswith(':d'):
         try:
             num = int(word[2:])
@@ -129,7 +416,12 @@ def on_ctrl_del(event):
     return 'break'
 
 def on_select(index):
-    show_translation(index)
+    show_translation(dict_index(index))
+    prefetch_near(index)
+
+def prefetch_near(n):
+    'reads definitions likely to be shown after n-th item of the word index'
+    prefetcher.moved(dict_active, n, windex.top, windex.bot, windex.itemcnt, dict_index)
 
 def on_updown(event):
     if windex.select < 0:
@@ -138,8 +430,37 @@ def on_updown(event):
         windex.down()
     else:
         windex.up()
-    show_translation(windex.select)
-
+    show_translation(dict_index(windex.select))
+
+
+# set of all dictionaries while searching in all of them
+dset = None
+# futures of the last search in all dictionaries
+pending = None
+# words offered for the last word not found and the search of them
+suggestions = []
+suggesting = None
+# trigram index of the active dictionary and words found by it
+infix_index = None
+infix_build = None
+matches = None
+INFIX_PAGE = 200
+# slow work off the Tk thread, results are polled by when_done()
+worker = ThreadPoolExecutor(1, thread_name_prefix='gui')
+WORKER_POLL = 20
+# milliseconds between checks of a dictionary loading
+LOAD_POLL = 100
+# parsed definitions of recently shown entries
+rendered = RunCache()
+# and of those likely to be shown next
+prefetcher = Prefetcher(rendered)
+# search of words typed and translation shown after a pause in typing
+searcher = None
+scheduled = None
+DEBOUNCE = 120
+# recently used dictionaries stay loaded within this many bytes
+POOL_BUDGET = 512*1024*1024
+dpool = DictionaryPool(POOL_BUDGET)
 
 root = tk.Tk()
 root.resizable(height=False, width=False)
@@ -163,6 +484,7 @@ wentry.red = False
 
 # word index
 windex = WordIndexWindow(root, height=15, callback=on_select)
+windex.near_end = more_matches
 windex.lbox['font'] = text_font
 
 # translation text window
@@ -205,12 +527,25 @@ textwin.tag_config("normal"  , foreground="black"  , font=font_normal)
 textwin.tag_config("<b>"     , foreground="black"  , font=font_bold)
 textwin.tag_config("<i>"     , foreground="black"  , font=font_italic)
 textwin.tag_config("<small>" , foreground="black"  , font=font_small)
+textwin.tag_config("<u>"     , underline=1)
+textwin.tag_config("<sup>"   , offset=4, font=font_small)
+textwin.tag_config("<sub>"   , offset=-2, font=font_small)
+textwin.tag_config("<abr>"   , foreground="darkgreen", font=font_italic)
+textwin.tag_config("<ex>"    , foreground="gray30", font=font_italic)
+textwin.tag_config("<tr>"    , foreground="brown")
+textwin.tag_config("<kref>"  , foreground="blue")
+textwin.tag_config("<blockquote>", lmargin1=20, lmargin2=20)
 
 textwin.tag_config("<a>", foreground="blue", underline=1)
 textwin.tag_bind("<a>", "<ButtonRelease-1>", on_dict_select)
 textwin.tag_bind("<a>", "<Enter>", lambda e:e.widget.config(cursor="hand1"))
 textwin.tag_bind("<a>", "<Leave>", lambda e:e.widget.config(cursor="arrow"))
 
+textwin.tag_config("<sugg>", foreground="blue", font=font_normal)
+textwin.tag_bind("<sugg>", "<ButtonRelease-1>", on_sugg_select)
+textwin.tag_bind("<sugg>", "<Enter>", lambda e:e.widget.config(cursor="hand1"))
+textwin.tag_bind("<sugg>", "<Leave>", lambda e:e.widget.config(cursor="arrow"))
+
 # grid configuration
 wentry .grid(row=0, column=0, sticky='NEWS')
 windex .grid(row=1, column=0)
@@ -220,26 +555,23 @@ bottom_frame.grid(row=2, column=0, columnspan=2, sticky='WE')
 
 if __name__ == '__main__':
 
-    import stardict as sdict
     import config as sconf
 
+    # PYSTARDICT_METRICS=file[:seconds] dumps metrics to file
+    metrics.from_env()
+
     print('dicts lookup')
-#    ifos = sdict.look_for_dicts('./dic')
-    ifos = sdict.look_for_dicts(sconf.Config().get_dictdir())
-#    ifos = sdict.look_for_dicts('C:\\Users\\blang\\OneDrive\\PythonProjects\\WatchDicHistory\\pyStarDictViewer\\dic')
-    dicts = []
-    for ifo in ifos:
-        try:
-            dicts.append(sdict.StarDict(ifo, False));
-        except ValueError:
-            print('Could NOT load', ifo)
-     
-    dicts = sorted(dicts, key=lambda d:d.ifo['bookname']+d.ifo['wordcount'])
+    # dictionaries found last time, the tree is rescanned meanwhile
+    catalog = Catalog(sconf.Config().get_dictdir())
+    dicts = sort_dicts(catalog.stardicts())
+    catalog.refresh()
+    root.after(500, poll_catalog, catalog)
     print('loading')
 
     dict_active = dicts[0]
-    dict_active.load()
     windex.rebind(dict_active) 
+    dpool.use(dict_active, False)
+    start_loading(dict_active)
     print('done')
 
     show_dicts()
@@ -247,4 +579,5 @@ if __name__ == '__main__':
     root.wm_title(dict_active.ifo['bookname'])
     wentry.focus_set()
     root.mainloop()
+    metrics.stop_dump()
     
@@ -0,0 +1,62 @@
+'''
+prefix search of a word typed letter by letter
+
+Words starting with a prefix are a range of the sorted index, the
+range of a longer prefix lies within it. IncrementalSearch keeps the
+ranges of the prefixes searched before, so each new letter is only
+looked up within the range of the word without it, and deleting
+letters goes back to a range already known.
+'''
+import stardict as sdict
+import metrics
+
+
+class IncrementalSearch:
+    'prefix searches in StarDict d, see StarDict.search'
+
+    def __init__(self, d):
+        self.d = d
+        # (word, ranges in the indexes) of prefixes of the last word
+        self.stack = []
+        self.state = None
+
+    def _indexes(self):
+        d = self.d
+        return [d.idx] if d.syn is None else [d.idx, d.syn]
+
+    def search(self, word):
+        'index of the first word starting with word, -1 when there is none'
+        if word == '':
+            return -1
+        t = metrics.start()
+        d = self.d
+        indexes = self._indexes()
+        # ranges are stale when the index changed or still grows
+        state = [(ix, len(ix)) for ix in indexes]
+        if state != self.state:
+            self.state = state
+            self.stack = []
+        while self.stack and not word.startswith(self.stack[-1][0]):
+            self.stack.pop()
+        key = sdict.collation_key(word)[0]
+        # UTF-8 has no 0xff byte, all keys with the prefix are lower
+        end = key+b'\xff'
+        ranges = []
+        for n, ix in enumerate(indexes):
+            lo, hi = self.stack[-1][1][n] if self.stack else (0, len(ix))
+            lo = ix.bisect(key, lo, hi)
+            ranges.append((lo, ix.bisect(end, lo, hi)))
+        self.stack.append((word, ranges))
+
+        lo, hi = ranges[0]
+        i = lo if lo < hi else -1
+        if len(ranges) > 1 and ranges[1][0] < ranges[1][1]:
+            # the lower of both matches, words win the tie
+            j = ranges[1][0]
+            if i < 0 or d.syn.key(j) < d.idx.key(i):
+                i = d.syn.target(j)
+        if i < 0 and not word.isascii():
+            # case variants of other letters
+            i = d.search(word, True)
+        metrics.stop('search.incremental', t)
+        return i
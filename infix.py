@@ -0,0 +1,214 @@
+'''
+search of words containing a string anywhere in them
+
+InfixIndex keeps for every trigram (three letters) of lowercased
+words the sorted indexes of words containing it. Words matching
+a string are among those in the shortest list of its trigrams, so
+only those are checked; strings shorter than three letters are
+checked against all words, but found words are produced one by one
+so showing a page of them doesn't need to go through everything.
+'''
+import os
+import mmap
+import struct
+import bisect
+from array import array
+from collections import defaultdict
+
+import stardict as sdict
+
+
+def trigrams(word):
+    return set(word[i:i+3] for i in range(len(word)-2))
+
+
+class InfixIndex:
+    '''
+    trigram index of words of a dictionary, it can be
+    stored in a file with extension .trigram (see stardict.cache_path)
+    '''
+    ext     = '.trigram'
+    magic   = b'PYSDTRI\0'
+    version = 1
+    # magic, version, .idx size, .idx mtime, words, trigrams, trigrams data length
+    header  = struct.Struct('<8sHxxxxxxQqQQQ')
+
+    def __init__(self, d, postings=None):
+        '''
+        d is a loaded StarDict, postings is a dict trigram -> array
+        of word indexes, it's built from d when not given
+        '''
+        self.d = d
+        self.data = None
+        if postings is None:
+            postings = self._build(d)
+        self.grams = sorted(postings)
+        self.postings = [postings[g] for g in self.grams]
+
+    @staticmethod
+    def _build(d):
+        postings = defaultdict(lambda: array('I'))
+        for i in range(len(d)):
+            for g in trigrams(d[i].lower()):
+                # words are visited in order, so the arrays are sorted
+                postings[g].append(i)
+        return postings
+
+    @classmethod
+    def open(cls, d, cache=True):
+        '''
+        returns the index of StarDict d, read from its file
+        if it's up to date, otherwise built and stored when
+        cache isn't False
+        '''
+        if not cache:
+            return cls(d)
+        path = sdict.cache_path(d.fname+'.idx', cls.ext, cache)
+        st = os.stat(d.fname+'.idx')
+        index = cls._load(d, path, st)
+        if index is None:
+            index = cls(d)
+            index._write(path, st)
+        return index
+
+    @classmethod
+    def _load(cls, d, path, st):
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return None
+        with f:
+            header = f.read(cls.header.size)
+            if len(header) != cls.header.size:
+                return None
+            magic, version, size, mtime, count, ngrams, gramslen = cls.header.unpack(header)
+            if (magic != cls.magic or version != cls.version or count != len(d) or
+                    size != st.st_size or mtime != st.st_mtime_ns):
+                return None
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        pos = cls.header.size
+        starts = array('Q')
+        starts.frombytes(data[pos:pos+8*(ngrams+1)])
+        pos += 8*(ngrams+1)
+        grams = data[pos:pos+gramslen].decode('utf8').split('\0') if ngrams else []
+        pos += gramslen
+        index = cls.__new__(cls)
+        index.d = d
+        index.data = data
+        index.grams = grams
+        # postings are views into the mapped file
+        view = memoryview(data)
+        index.postings = [view[pos+starts[n]:pos+starts[n+1]].cast('I')
+                          for n in range(ngrams)]
+        return index
+
+    def _write(self, path, st):
+        "stores the index, returns False when it can't be written"
+        grams = '\0'.join(self.grams).encode('utf8')
+        starts = array('Q', [0])
+        for p in self.postings:
+            starts.append(starts[-1]+4*len(p))
+        def write(f):
+            f.write(self.header.pack(self.magic, self.version, st.st_size,
+                                     st.st_mtime_ns, len(self.d),
+                                     len(self.grams), len(grams)))
+            f.write(starts.tobytes())
+            f.write(grams)
+            for p in self.postings:
+                f.write(p.tobytes())
+        return sdict.atomic_write(path, write)
+
+    def _posting(self, gram):
+        n = bisect.bisect_left(self.grams, gram)
+        if n == len(self.grams) or self.grams[n] != gram:
+            return ()
+        return self.postings[n]
+
+    def iter_search(self, text, start=0):
+        '''
+        yields indexes of words containing text (case insensitive)
+        in order of words, from the word at index start
+        '''
+        text = text.lower()
+        if not text:
+            return
+        d = self.d
+        if len(text) < 3:
+            candidates = range(start, len(d))
+        else:
+            lists = sorted((self._posting(g) for g in trigrams(text)), key=len)
+            candidates = lists[0]
+            if len(lists) > 1 and len(candidates) > 64:
+                # narrow down by the second shortest list
+                other = set(lists[1])
+                candidates = [i for i in candidates if i in other]
+            # copied, so a suspended search holds no view of the mapped file
+            candidates = candidates[bisect.bisect_left(candidates, start):]
+            if isinstance(candidates, memoryview):
+                candidates = candidates.tolist()
+        for i in candidates:
+            if text in d[i].lower():
+                yield i
+
+    def search(self, text, start=0, limit=None):
+        '''
+        list of at most limit indexes of words containing text,
+        from the word at index start, so next page starts after
+        the last index returned
+        '''
+        found = []
+        for i in self.iter_search(text, start):
+            if limit is not None and len(found) >= limit:
+                break
+            found.append(i)
+        return found
+
+    def close(self):
+        # views into the mapped file must be released before it's closed
+        for p in self.postings:
+            if isinstance(p, memoryview):
+                p.release()
+        self.postings = []
+        self.grams = []
+        if self.data is not None:
+            try:
+                self.data.close()
+            except BufferError:
+                # views are still held, the mapping goes with the last of them
+                pass
+            self.data = None
+
+
+class Matches:
+    '''
+    words found by InfixIndex.iter_search() as a sequence
+    for WordIndexWindow, they are fetched in pages by fetch()
+    '''
+    def __init__(self, d, found):
+        self.d = d
+        self.found = found
+        self.indexes = []
+        self.done = False
+
+    def fetch(self, count):
+        'gets up to count more words, returns False when there are no more'
+        for i in self.found:
+            self.indexes.append(i)
+            count -= 1
+            if count <= 0:
+                return True
+        self.done = True
+        return False
+
+    def close(self):
+        'stops the search, no more words are fetched'
+        self.found.close()
+        self.done = True
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def __getitem__(self, key):
+        if type(key) is slice:
+            return [self.d[i] for i in self.indexes[key]]
+        return self.d[self.indexes[key]]
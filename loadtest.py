@@ -0,0 +1,146 @@
+'''
+load test of the lookup service (see server.py)
+
+    python loadtest.py [--connections 8] [--pipeline 4] [--requests 20000]
+
+Connections are kept alive, each of them sends pipeline requests
+at once and reads their responses before sending more. Words are
+collected from the service first (/prefix of a few letters), then
+exact lookups, prefix lookups and batches of them are sent in the
+given mix; throughput and latency percentiles are printed as JSON.
+'''
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from urllib.parse import quote
+
+
+def _percentiles(times):
+    times = sorted(times)
+    if not times:
+        return {}
+    pick = lambda p: times[min(len(times)-1, int(p*len(times)))]*1e3
+    return {'p50_ms': pick(.5), 'p90_ms': pick(.9), 'p99_ms': pick(.99),
+            'max_ms': times[-1]*1e3}
+
+
+def _request(host, path, body=None):
+    if body is None:
+        head = 'GET %s HTTP/1.1\r\nHost: %s\r\n\r\n' % (path, host)
+        return head.encode('latin1')
+    body = json.dumps(body).encode('utf8')
+    head = ('POST %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\n'
+            'Content-Length: %d\r\n\r\n' % (path, host, len(body)))
+    return head.encode('latin1')+body
+
+
+async def _read_response(reader):
+    'returns (status, body) of the next response'
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, sep, value = line.decode('latin1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def fetch(host, port, path, body=None):
+    'one request on its own connection, returns decoded JSON'
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(_request(host, path, body))
+        status, data = await _read_response(reader)
+        return json.loads(data.decode('utf8'))
+    finally:
+        writer.close()
+
+
+async def collect_words(host, port, count, rnd):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+    for n in range(200):
+        if len(words) >= count:
+            break
+        prefix = rnd.choice(letters)+rnd.choice(letters)
+        found = await fetch(host, port, '/prefix?limit=50&word='+quote(prefix))
+        for r in found['results']:
+            words.update(r['words'])
+    return sorted(words)
+
+
+def _make(kind, words, rnd, batch):
+    if kind == 'lookup':
+        return '/lookup?word='+quote(rnd.choice(words)), None
+    if kind == 'prefix':
+        w = rnd.choice(words)
+        return '/prefix?word='+quote(w[:rnd.randint(1, len(w))]), None
+    return '/batch', {'words': [rnd.choice(words) for n in range(batch)]}
+
+
+async def _connection(host, port, jobs, pipeline, stats):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while jobs:
+            sent = []
+            while jobs and len(sent) < pipeline:
+                path, body = jobs.pop()
+                writer.write(_request(host, path, body))
+                sent.append((path, time.perf_counter()))
+            await writer.drain()
+            for path, t in sent:
+                status, data = await _read_response(reader)
+                stats['latency'].append(time.perf_counter()-t)
+                stats['bytes'] += len(data)
+                if status != 200:
+                    stats['errors'] += 1
+    finally:
+        writer.close()
+
+
+async def run(args):
+    rnd = random.Random(args.seed)
+    words = await collect_words(args.host, args.port, 2000, rnd)
+    if not words:
+        raise SystemExit('no words found, are there dictionaries?')
+    kinds = {'lookup': 7, 'prefix': 2, 'batch': 1}
+    if args.kind != 'mixed':
+        kinds = {args.kind: 1}
+    choices = [k for k, n in kinds.items() for m in range(n)]
+    jobs = [_make(rnd.choice(choices), words, rnd, args.batch)
+            for n in range(args.requests)]
+    stats = {'latency': [], 'bytes': 0, 'errors': 0}
+    t = time.perf_counter()
+    await asyncio.gather(*[_connection(args.host, args.port, jobs, args.pipeline, stats)
+                           for n in range(args.connections)])
+    elapsed = time.perf_counter()-t
+    return {'requests': len(stats['latency']), 'errors': stats['errors'],
+            'seconds': elapsed, 'requests_per_s': len(stats['latency'])/elapsed,
+            'mb_per_s': stats['bytes']/elapsed/1e6,
+            'latency': _percentiles(stats['latency']),
+            'params': vars(args)}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='load test of server.py')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8787)
+    p.add_argument('--connections', type=int, default=8)
+    p.add_argument('--pipeline', type=int, default=4)
+    p.add_argument('--requests', type=int, default=20000)
+    p.add_argument('--kind', choices=('mixed', 'lookup', 'prefix', 'batch'), default='mixed')
+    p.add_argument('--batch', type=int, default=20, help='words in a batch')
+    p.add_argument('--seed', type=int, default=1)
+    args = p.parse_args(argv)
+    json.dump(asyncio.run(run(args)), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+'''
+counters and latency histograms of hot paths
+
+Metrics are off by default, instrumented code then only checks
+the module flag `enabled` (or gets None from start()). When they are on, snapshot() returns everything collected
+so far and dump() (or a periodic dumper from start_dump()) appends
+it as a JSON line to a file:
+
+    import metrics
+    metrics.enable()
+    ...
+    print(metrics.snapshot())
+
+Setting PYSTARDICT_METRICS=file[:seconds] in the environment turns
+them on with periodic dumps for programs calling from_env().
+'''
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+
+enabled = False
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_histograms = {}
+_dumper = None
+
+# latencies in microseconds are put in buckets, each power
+# of two is split into four of them (error below 25 %)
+BUCKETS = 140
+
+
+def _bucket(us):
+    v = int(us)
+    e = v.bit_length()
+    if e < 3:
+        return v
+    return min(4*(e-2)+((v >> (e-3)) & 3), BUCKETS-1)
+
+
+def _bucket_end(b):
+    'upper bound of bucket b in microseconds'
+    if b < 4:
+        return b+1
+    e, sub = divmod(b-4, 4)
+    return (5+sub) << e
+
+
+class Histogram:
+    'latencies in buckets with exact count, total, min and max'
+
+    def __init__(self):
+        self.buckets = [0]*BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.buckets[_bucket(seconds*1e6)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        'upper bound of the p-th (0-1) percentile in seconds'
+        if not self.count:
+            return 0.0
+        rank = p*self.count
+        seen = 0
+        for b, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(_bucket_end(b)*1e-6, self.max)
+        return self.max
+
+    def summary(self):
+        us = lambda s: round(s*1e6, 1)
+        return {'count': self.count, 'total_s': self.total,
+                'mean_us': us(self.total/self.count) if self.count else 0.0,
+                'min_us': us(self.min or 0.0), 'max_us': us(self.max),
+                'p50_us': us(self.percentile(.5)), 'p90_us': us(self.percentile(.9)),
+                'p99_us': us(self.percentile(.99))}
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def count(name, n=1):
+    'adds n to counter name'
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] += n
+
+
+def observe(name, seconds):
+    'records a latency of seconds in histogram name'
+    if not enabled:
+        return
+    with _lock:
+        h = _histograms.get(name)
+        if h is None:
+            h = _histograms[name] = Histogram()
+        h.add(seconds)
+
+
+def start():
+    'start time for stop(), None when metrics are off'
+    return time.perf_counter() if enabled else None
+
+
+def stop(name, t):
+    'records time since start() t in histogram name'
+    if t is not None:
+        observe(name, time.perf_counter()-t)
+
+
+class timer:
+    '''
+    context manager recording the duration of its block,
+    for code not hot enough to need start() and stop()
+    '''
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t = start()
+        return self
+
+    def __exit__(self, *exc):
+        stop(self.name, self.t)
+
+
+def snapshot():
+    'counters and histogram summaries collected so far'
+    with _lock:
+        return {'time': time.time(),
+                'counters': dict(_counters),
+                'histograms': {name: h.summary() for name, h in _histograms.items()}}
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def dump(path):
+    'appends a snapshot to file path as a line of JSON'
+    with open(path, 'a') as f:
+        f.write(json.dumps(snapshot())+'\n')
+
+
+class _Dumper(threading.Thread):
+    def __init__(self, path, interval):
+        super().__init__(name='metrics-dump', daemon=True)
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                dump(self.path)
+            except OSError:
+                pass
+
+
+def start_dump(path, interval=60):
+    'turns metrics on and dumps them to path every interval seconds'
+    global _dumper
+    stop_dump()
+    enable()
+    _dumper = _Dumper(path, interval)
+    _dumper.start()
+
+
+def stop_dump():
+    'stops periodic dumps, writing the last snapshot'
+    global _dumper
+    if _dumper is not None:
+        _dumper.stopped.set()
+        _dumper.join()
+        dump(_dumper.path)
+        _dumper = None
+
+
+def from_env(name='PYSTARDICT_METRICS'):
+    'starts periodic dumps when environment variable name is file[:seconds]'
+    value = os.environ.get(name)
+    if not value:
+        return False
+    path, sep, interval = value.rpartition(':')
+    if not sep or not interval.isdigit():
+        path, interval = value, '60'
+    start_dump(path, int(interval))
+    return True
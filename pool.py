@@ -0,0 +1,81 @@
+'''
+loaded dictionaries kept within a memory budget
+'''
+import threading
+from collections import OrderedDict
+
+
+class DictionaryPool:
+    '''
+    keeps recently used StarDict objects loaded while their resident
+    size (see StarDict.resident_size) fits in budget bytes, the least
+    recently used ones are unloaded first; the most recently used one
+    stays loaded whatever its size
+    '''
+    def __init__(self, budget=512*1024*1024):
+        self.budget = budget
+        self.lock = threading.Lock()
+        # least recently used first
+        self.dicts = OrderedDict()
+
+    def __len__(self):
+        return len(self.dicts)
+
+    def __contains__(self, d):
+        return id(d) in self.dicts
+
+    def use(self, d, load=True):
+        '''
+        marks d as the most recently used one, loads it unless
+        load is False (e.g. it's loaded by load_async()) and unloads
+        others over the budget; returns d
+        '''
+        with self.lock:
+            self.dicts[id(d)] = d
+            self.dicts.move_to_end(id(d))
+        if load and not d.loaded:
+            d.load()
+        self.evict()
+        return d
+
+    def sizes(self):
+        'list of (dictionary, resident bytes), the most recently used first'
+        with self.lock:
+            dicts = list(self.dicts.values())
+        return [(d, d.resident_size()) for d in reversed(dicts)]
+
+    def resident_size(self):
+        return sum(size for d, size in self.sizes())
+
+    def evict(self):
+        'unloads the least recently used dictionaries over the budget'
+        sizes = self.sizes()
+        total = sum(size for d, size in sizes)
+        evicted = []
+        while total > self.budget and len(sizes) > 1:
+            d, size = sizes.pop()
+            total -= size
+            evicted.append(d)
+        with self.lock:
+            for d in evicted:
+                self.dicts.pop(id(d), None)
+        for d in evicted:
+            d.unload()
+        return evicted
+
+    def discard(self, d):
+        'forgets d without unloading it'
+        with self.lock:
+            self.dicts.pop(id(d), None)
+
+    def clear(self):
+        'unloads all dictionaries'
+        with self.lock:
+            dicts = list(self.dicts.values())
+            self.dicts.clear()
+        for d in dicts:
+            d.unload()
+
+    def report(self):
+        'lines with resident sizes of dictionaries in MB'
+        return ['%8.1f MB  %s' % (size/1e6, d.ifo['bookname']) for d, size in self.sizes()]
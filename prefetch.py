@@ -0,0 +1,85 @@
+'''
+background reading of definitions near the one shown
+
+Words are mostly browsed one after another, so when an entry is
+shown, Prefetcher reads and parses the entries that are likely to be
+shown next into a render.RunCache on its own thread: those ahead in
+the direction of the last move first, then the rest of the visible
+part of the word index and a few behind. Stepping to the next entry
+then takes its runs from the cache without reading or inflating
+anything. A new move replaces the work left from the previous one.
+'''
+import threading
+
+import metrics
+
+
+class Prefetcher:
+    '''
+    fills RunCache cache with ahead entries in the direction of
+    navigation, the visible ones and behind entries the other way
+    '''
+    def __init__(self, cache, ahead=8, behind=2):
+        self.cache = cache
+        self.ahead = ahead
+        self.behind = behind
+        # (dictionary, position) of the last move and its direction
+        self.last = None
+        self.direction = 1
+        self.cond = threading.Condition()
+        self.job = None
+        self.thread = None
+
+    def plan(self, pos, top, bot, count):
+        'positions to read after the one at pos, most likely first'
+        step = self.direction
+        order = [pos+step*n for n in range(self.ahead+1)]
+        order += range(top, bot+1)
+        order += [pos-step*n for n in range(1, self.behind+1)]
+        seen = set()
+        out = []
+        for p in order:
+            if 0 <= p < count and p not in seen:
+                seen.add(p)
+                out.append(p)
+        return out
+
+    def moved(self, d, pos, top, bot, count, index=None):
+        '''
+        StarDict d shows position pos of count items, top and bot are
+        the visible ones; index maps positions to indexes of d
+        '''
+        if self.last is not None and self.last[0] is d and pos != self.last[1]:
+            self.direction = 1 if pos > self.last[1] else -1
+        self.last = (d, pos)
+        plan = self.plan(pos, top, bot, count)
+        if index is not None:
+            plan = [index(p) for p in plan]
+        with self.cond:
+            self.job = (d, plan)
+            self.cond.notify()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='prefetch', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.job is None:
+                    self.cond.wait()
+                d, plan = self.job
+                self.job = None
+            for i in plan:
+                if self.job is not None:
+                    # a newer move
+                    break
+                if not d.loaded:
+                    break
+                if (d.fname, i) in self.cache:
+                    continue
+                try:
+                    self.cache.get(d, i)
+                except Exception:
+                    # unloaded meanwhile, the index is empty or files closed
+                    break
+                metrics.count('prefetch.entries')
@@ -0,0 +1,135 @@
+'''
+definitions parsed to runs of text and formatting tags
+
+parse() goes through a definition once and gives a flat tuple
+(text, tags, text, tags, ...) ready for one Tkinter Text.insert()
+call, so a long definition is one Tcl round trip instead of one per
+fragment. Elements of the XDXF and HTML subset used by dictionaries
+of sametypesequence 'x' and 'g' map to the Text tags in TAGS, nested
+elements give a run all their tags, other elements are left out
+keeping their text. RunCache keeps runs of recently shown entries.
+'''
+import re
+import html
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# element -> Text tag of its content
+TAGS = {
+    'b': '<b>', 'strong': '<b>', 'k': '<b>',
+    'i': '<i>', 'em': '<i>',
+    'small': '<small>', 'co': '<small>',
+    'u': '<u>', 'sup': '<sup>', 'sub': '<sub>',
+    'abr': '<abr>', 'ex': '<ex>', 'tr': '<tr>', 'kref': '<kref>',
+    'blockquote': '<blockquote>',
+}
+# elements that stand for a line break
+BREAKS = {'br', 'p', 'div'}
+# tag of text outside of any element above
+NORMAL = 'normal'
+
+_token = re.compile(r'''
+    <(/?)([A-Za-z][\w:-]*)[^<>]*?(/?)>  # start, end or empty element
+  | <!--.*?-->                          # comment
+  | &(\#?\w+);                          # entity
+  | [^<&]+ | [<&]                       # text
+''', re.X | re.S)
+
+
+def parse(text, base=(NORMAL,)):
+    '''
+    flat tuple (text, tags, ...) of runs of str text, tags is
+    a tuple of Text tags, base when no element applies
+    '''
+    out = []
+    # open elements, (name, tag or None)
+    stack = []
+    tags = base
+    buf = []
+    for m in _token.finditer(text):
+        close, name, empty, entity = m.group(1, 2, 3, 4)
+        if name is None:
+            if entity is not None:
+                buf.append(html.unescape(m.group()))
+            elif not m.group().startswith('<!--'):
+                buf.append(m.group())
+            continue
+        name = name.lower()
+        if name in BREAKS:
+            if name == 'br' or close:
+                buf.append('\n')
+            continue
+        tag = TAGS.get(name)
+        if empty:
+            continue
+        if close:
+            # the last element of that name, unclosed ones inside go too
+            for n in range(len(stack)-1, -1, -1):
+                if stack[n][0] == name:
+                    del stack[n:]
+                    break
+            else:
+                continue
+        else:
+            stack.append((name, tag))
+        new = tuple(t for n, t in stack if t is not None) or base
+        if new != tags:
+            if buf:
+                out += (''.join(buf), tags)
+                buf = []
+            tags = new
+    if buf:
+        out += (''.join(buf), tags)
+    return tuple(out)
+
+
+def insert(textwin, index, runs):
+    'inserts runs of parse() to Text textwin at index in one call'
+    if runs:
+        textwin.insert(index, *runs)
+
+
+class RunCache:
+    '''
+    runs of definitions, the size most recently used ones are
+    kept by (dictionary file, index)
+    '''
+    def __init__(self, size=256):
+        self.size = size
+        self.lock = threading.Lock()
+        self.runs = OrderedDict()
+
+    def get(self, d, index, data=None):
+        '''
+        runs of definition index of StarDict d, data are its
+        bytes when they have been read already
+        '''
+        key = (d.fname, index)
+        with self.lock:
+            runs = self.runs.get(key)
+            if runs is not None:
+                self.runs.move_to_end(key)
+        if runs is not None:
+            metrics.count('render.cache_hits')
+            return runs
+        metrics.count('render.cache_misses')
+        if data is None:
+            data = d.dict_view(index)
+        text = str(data, 'utf8', 'replace')
+        t = metrics.start()
+        runs = parse(text)
+        metrics.stop('render.parse', t)
+        with self.lock:
+            self.runs[key] = runs
+            while len(self.runs) > self.size:
+                self.runs.popitem(last=False)
+        return runs
+
+    def __contains__(self, key):
+        return key in self.runs
+
+    def clear(self):
+        with self.lock:
+            self.runs.clear()
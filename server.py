@@ -0,0 +1,337 @@
+'''
+local HTTP/JSON lookup service
+
+Loads dictionaries once and serves lookups to other tools over
+localhost, so they share one warm process:
+
+    python server.py [--port 8787] [dictionary directories]
+
+    GET  /dicts                           dictionaries (dict numbers)
+    GET  /lookup?word=W[&prefix=1][&dict=N]   translations of W
+    GET  /prefix?word=W[&limit=20][&dict=N]   words starting with W
+    POST /batch  {"words": [...], "prefix": false, "dict": [N, ...]}
+    GET  /metrics                         see metrics.py
+
+dict can be given more times, all dictionaries are searched without
+it. Connections are kept alive and pipelined requests are handled
+concurrently, responses are sent in order of requests. Searching is
+fast enough for the event loop, reading translations is done on
+a thread pool with a bounded number of jobs waiting for it.
+'''
+import json
+import asyncio
+import argparse
+import collections
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import stardict as sdict
+import metrics
+from asyncdict import Limiter
+
+Request = collections.namedtuple('Request', 'method target headers body keep_alive')
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+
+
+def _response(status, obj, keep_alive):
+    body = json.dumps(obj, ensure_ascii=False).encode('utf8')
+    head = ('HTTP/1.1 %d %s\r\n'
+            'Content-Type: application/json; charset=utf-8\r\n'
+            'Content-Length: %d\r\n'
+            'Connection: %s\r\n\r\n' % (status, HTTPStatus(status).phrase, len(body),
+                                        'keep-alive' if keep_alive else 'close'))
+    return head.encode('latin1')+body
+
+
+class LookupService:
+    '''
+    serves lookups in loaded StarDict objects dicts,
+    translations are read by workers threads with at most
+    queue jobs waiting; pipeline is the number of requests
+    of a connection handled at once
+    '''
+    max_body  = 1024*1024
+    max_batch = 1000
+
+    def __init__(self, dicts, workers=4, queue=None, pipeline=16):
+        self.dicts = dicts
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='lookup')
+        self.queue = queue or 4*workers
+        self.limiter = Limiter(self.queue, self.pool)
+        self.pipeline = pipeline
+        self.routes = {('GET', '/dicts'): self.get_dicts,
+                       ('GET', '/lookup'): self.get_lookup,
+                       ('GET', '/prefix'): self.get_prefix,
+                       ('POST', '/batch'): self.post_batch,
+                       ('GET', '/metrics'): self.get_metrics}
+
+    async def run(self, fn, *args):
+        'runs blocking fn on the pool, waits while it is full'
+        return await self.limiter.run(fn, *args)
+
+    def _selected(self, nums):
+        'numbered dictionaries selected by dict parameters'
+        if not nums:
+            return list(enumerate(self.dicts))
+        try:
+            nums = [int(n) for n in nums]
+        except (TypeError, ValueError):
+            raise HTTPError(400, 'dict must be a number')
+        if any(not 0 <= n < len(self.dicts) for n in nums):
+            raise HTTPError(404, 'unknown dict')
+        return [(n, self.dicts[n]) for n in nums]
+
+    @staticmethod
+    def _word(query):
+        word = query.get('word', [''])[0]
+        if not word:
+            raise HTTPError(400, 'word missing')
+        return word
+
+    @staticmethod
+    def _hit(num, d, i, data):
+        return {'dict': num, 'bookname': d.ifo['bookname'], 'index': i,
+                'word': d[i], 'data': str(data, 'utf8', 'replace')}
+
+    async def get_dicts(self, query, body):
+        return [{'dict': n, 'bookname': d.ifo['bookname'],
+                 'wordcount': len(d), 'file': d.fname+'.ifo'}
+                for n, d in enumerate(self.dicts)]
+
+    async def get_lookup(self, query, body):
+        word = self._word(query)
+        prefix = query.get('prefix', ['0'])[0] not in ('0', '', 'false')
+        found = [(n, d, d.search(word, prefix)) for n, d in self._selected(query.get('dict'))]
+        found = [(n, d, i) for n, d, i in found if i >= 0]
+        texts = await asyncio.gather(*[self.run(d.dict_view, i) for n, d, i in found])
+        return {'word': word,
+                'results': [self._hit(n, d, i, t) for (n, d, i), t in zip(found, texts)]}
+
+    async def get_prefix(self, query, body):
+        word = self._word(query)
+        try:
+            limit = min(int(query.get('limit', ['20'])[0]), 1000)
+        except ValueError:
+            raise HTTPError(400, 'limit must be a number')
+        results = []
+        for n, d in self._selected(query.get('dict')):
+            i = d.search(word, True)
+            if i < 0:
+                continue
+            results.append({'dict': n, 'bookname': d.ifo['bookname'],
+                            'index': i, 'words': self._prefixed(d, word, limit)})
+        return {'word': word, 'results': results}
+
+    @staticmethod
+    def _prefixed(d, word, limit):
+        '''
+        up to limit words and synonyms of d starting with word in
+        collation order; case variants are tried as search() does
+        '''
+        variants = [word]
+        if not word.isascii():
+            variants += [word.lower(), word.upper(), word[0].upper()+word[1:].lower()]
+        for w in variants:
+            key = sdict.collation_key(w)[0]
+            found = []
+            for ix in (d.idx, d.syn):
+                if ix is None:
+                    continue
+                lo = ix.bisect(key)
+                # UTF-8 has no 0xff byte, all keys with the prefix are lower
+                hi = min(ix.bisect(key+b'\xff', lo), lo+limit)
+                found += [ix.word(j) for j in range(lo, hi)]
+            if found:
+                return sorted(found, key=sdict.collation_key)[:limit]
+        return []
+
+    async def post_batch(self, query, body):
+        try:
+            req = json.loads(body.decode('utf8'))
+            words = req['words']
+            prefix = bool(req.get('prefix', False))
+            nums = req.get('dict')
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise HTTPError(400, 'JSON object with words expected')
+        if not isinstance(words, list) or not all(isinstance(w, str) for w in words):
+            raise HTTPError(400, 'words must be a list of strings')
+        if len(words) > self.max_batch:
+            raise HTTPError(413, 'at most %d words' % self.max_batch)
+        if isinstance(nums, int):
+            nums = [nums]
+        selected = self._selected(nums)
+        # each dictionary reads its translations in one go, see lookup_many
+        found = await asyncio.gather(*[self.run(d.lookup_many, words, prefix)
+                                       for n, d in selected])
+        results = [[] for w in words]
+        for (n, d), hits in zip(selected, found):
+            for k, hit in enumerate(hits):
+                if hit is not None:
+                    results[k].append(self._hit(n, d, *hit))
+        return {'results': [{'word': w, 'results': r} for w, r in zip(words, results)]}
+
+    async def get_metrics(self, query, body):
+        return metrics.snapshot()
+
+    async def respond(self, req):
+        'response to req as bytes'
+        t = metrics.start()
+        url = urlsplit(req.target)
+        handler = self.routes.get((req.method, url.path))
+        try:
+            if handler is None:
+                if any(path == url.path for method, path in self.routes):
+                    raise HTTPError(405)
+                raise HTTPError(404)
+            status, obj = 200, await handler(parse_qs(url.query), req.body)
+        except HTTPError as e:
+            status, obj = e.status, {'error': str(e)}
+        except Exception as e:
+            status, obj = 500, {'error': repr(e)}
+        metrics.count('server.status.%d' % status)
+        metrics.stop('server.request', t)
+        return _response(status, obj, req.keep_alive)
+
+    async def _read_request(self, reader):
+        'next request from reader, None at the end of connection'
+        try:
+            line = await reader.readline()
+            if not line.strip():
+                return None
+            parts = line.decode('latin1').split()
+            if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+                raise HTTPError(400)
+            method, target, version = parts
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, sep, value = line.decode('latin1').partition(':')
+                if not sep:
+                    raise HTTPError(400)
+                headers[name.strip().lower()] = value.strip()
+            try:
+                length = int(headers.get('content-length', 0))
+            except ValueError:
+                raise HTTPError(400)
+            if length > self.max_body:
+                raise HTTPError(413)
+            body = await reader.readexactly(length) if length > 0 else b''
+        except asyncio.IncompleteReadError:
+            return None
+        except (asyncio.LimitOverrunError, ValueError):
+            raise HTTPError(400)
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            keep_alive = connection == 'keep-alive'
+        else:
+            keep_alive = connection != 'close'
+        return Request(method.upper(), target, headers, body, keep_alive)
+
+    async def _send(self, responses, writer):
+        '''
+        writes responses in order of requests until None comes,
+        after a broken connection it only cancels them
+        '''
+        broken = False
+        while True:
+            item = await responses.get()
+            if item is None:
+                return
+            if broken:
+                item.cancel()
+                continue
+            try:
+                writer.write(await item)
+                await writer.drain()
+            except ConnectionError:
+                broken = True
+
+    async def handle(self, reader, writer):
+        'serves one connection'
+        metrics.count('server.connections')
+        # the size limits requests of a connection handled at once
+        responses = asyncio.Queue(self.pipeline)
+        sender = asyncio.ensure_future(self._send(responses, writer))
+        try:
+            while True:
+                try:
+                    req = await self._read_request(reader)
+                except HTTPError as e:
+                    await responses.put(asyncio.ensure_future(
+                        self._error(e.status)))
+                    break
+                if req is None:
+                    break
+                await responses.put(asyncio.ensure_future(self.respond(req)))
+                if not req.keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            await responses.put(None)
+            await sender
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    @staticmethod
+    async def _error(status):
+        return _response(status, {'error': HTTPStatus(status).phrase}, False)
+
+    async def serve(self, host='127.0.0.1', port=8787):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+def load_dicts(dirs, index='mmap'):
+    'loads dictionaries found in directories dirs, sorted as the viewer does'
+    dicts = []
+    for path in dirs:
+        for ifo in sdict.look_for_dicts(path):
+            try:
+                dicts.append(sdict.StarDict(ifo, index=index))
+            except ValueError:
+                print('Could NOT load', ifo)
+    return sorted(dicts, key=lambda d: d.ifo['bookname']+d.ifo['wordcount'])
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='local StarDict lookup service')
+    p.add_argument('dirs', nargs='*', default=['./dic'])
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8787)
+    p.add_argument('--index', choices=sorted(sdict.StarDict.index_types), default='mmap')
+    p.add_argument('--workers', type=int, default=4)
+    p.add_argument('--metrics', action='store_true', help='collect metrics for /metrics')
+    args = p.parse_args(argv)
+
+    metrics.enable(args.metrics)
+    dicts = load_dicts(args.dirs, args.index)
+    service = LookupService(dicts, args.workers)
+    print('serving %d dictionaries on http://%s:%d' % (len(dicts), args.host, args.port))
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        for d in dicts:
+            d.unload()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,134 @@
 import struct
 import os
+import sys
+import hashlib
 import gzip
 import zlib
+import mmap
+import threading
+import bisect
+from array import array
+from collections import OrderedDict
 
-class DictZip:
+from fuzzy import FuzzySearch
+import metrics
+
+if hasattr(os, 'pread'):
+    def _pread(f, lock, offset, size):
+        return os.pread(f.fileno(), size, offset)
+else:
+    # no positional reads (Windows), seek and read must not be interleaved
+    def _pread(f, lock, offset, size):
+        with lock:
+            f.seek(offset)
+            return f.read(size)
+
+
+class DictFile:
+    '''
+    uncompressed .dict, same interface as DictZip
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.fd = open(name, 'rb')
+        self.lock = threading.Lock()
+        self.offset = 0
+
+    def seek(self, offset):
+        self.offset = offset
+
+    def read(self, size):
+        out = self.pread(self.offset, size)
+        self.offset += len(out)
+        return out
+
+    def pread(self, offset, size):
+        'reads size bytes at offset, safe to be called from more threads'
+        return _pread(self.fd, self.lock, offset, size)
+
+    def pread_many(self, links, max_chunks=None):
+        'reads more (offset, size) pairs, returned in the same order'
+        return [self.pread(offset, size) for offset, size in links]
+
+    def iter_pread(self, links, max_chunks=None):
+        'yields (n, data) for links[n] in order of their offsets'
+        for n in sorted(range(len(links)), key=lambda n: links[n][0]):
+            yield n, self.pread(*links[n])
+
+    def view(self, offset, size):
+        'memoryview of size bytes at offset, see DictMmap.view()'
+        return memoryview(self.pread(offset, size))
+
+    def close(self):
+        self.fd.close()
+
+
+class DictMmap(DictFile):
+    '''
+    memory mapped uncompressed .dict, same interface as DictFile;
+    view() gives translations without copying them, so big
+    dictionaries are served straight from the page cache
+    '''
     def __init__(self, name):
+        DictFile.__init__(self, name)
+        try:
+            self.data = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self.fd.close()
+            raise
+        self.whole = memoryview(self.data)
+
+    def pread(self, offset, size):
+        'reads size bytes at offset, safe to be called from more threads'
+        return self.data[offset:offset+size]
+
+    def view(self, offset, size):
+        '''
+        memoryview of size bytes at offset of the mapped file,
+        a view held after close() keeps the mapping alive
+        '''
+        return self.whole[offset:offset+size]
+
+    def close(self):
+        self.whole.release()
+        try:
+            self.data.close()
+        except BufferError:
+            # views are still held, the mapping goes with the last of them
+            pass
+        self.fd.close()
+
+
+def open_dict(name):
+    '''
+    reader of uncompressed .dict name, mapped to memory unless
+    it can't be (it's empty or too big for the address space)
+    '''
+    try:
+        return DictMmap(name)
+    except (ValueError, OverflowError, OSError):
+        if not os.path.exists(name):
+            raise
+        return DictFile(name)
+
+
+class DictZip:
+    # default capacity of the decompressed chunks cache in bytes
+    cache_size = 2*1024*1024
+
+    def __init__(self, name, cache_size=None):
         self.name = name
-        self.deflate = zlib.decompressobj(-15)
         self.fd = open(name, 'rb')
+        self.lock = threading.Lock()
+        self.offset = 0
         t = self._read_header(self.fd)
         self.chlen   = t[0]
         self.sizes   = t[1]
         self.offsets = t[2]
         self.chcnt = len(self.sizes)
+        if cache_size is not None:
+            self.cache_size = cache_size
+        self.cache_clear()
 
     def _read_header(self, f):
         f.seek(0)
@@ -47,52 +163,766 @@ class DictZip:
         self.offset = offset
 
     def read(self, size):
+        'reads from the position set by seek() and moves it'
+        out = self.pread(self.offset, size)
+        self.offset += len(out)
+        return out
+
+    def pread(self, offset, size):
         '''
         determines which chunk to read and decompress
-        it's possible that data overrun to the following chunk
-        so this must be handled too
-        '''
-        chunk = self.offset//self.chlen
-        self.fd.seek(self.offsets[chunk])
-        compr = self.fd.read(self.sizes[chunk])
-        data = self.deflate.decompress(compr)
-        # offset in the chunk
-        chofs = self.offset % self.chlen
-        if chofs+size > self.chlen:
-            # data continue in the next chunk
-            out = data[chofs:]
-            self.seek(self.offset+len(out))
-            out += self.read(size-len(out))
-        else:
-            # all in the current chunk
-            out = data[chofs:chofs+size]
+        it's possible that data overrun to the following chunks
+        so this must be handled too;
+        there is no shared position, so more threads can read at once
+        '''
+        return self._read_chunks(offset, size, self._chunk)
+
+    def pread_many(self, links, max_chunks=8):
+        '''
+        reads more (offset, size) pairs, returned in the same order;
+        they are read sorted by offset, so each chunk is decompressed
+        only once and at most max_chunks of them are held meanwhile
+        '''
+        out = [None]*len(links)
+        for n, data in self.iter_pread(links, max_chunks):
+            out[n] = data
         return out
 
+    def iter_pread(self, links, max_chunks=8):
+        '''
+        yields (n, data) for links[n] in order of their offsets,
+        see pread_many()
+        '''
+        window = OrderedDict()
+        def chunk_data(chunk):
+            data = window.get(chunk)
+            if data is None:
+                data = self._cached(chunk) or self._inflate(chunk)
+                window[chunk] = data
+                if len(window) > max_chunks:
+                    window.popitem(last=False)
+            return data
+
+        for n in sorted(range(len(links)), key=lambda n: links[n][0]):
+            yield n, self._read_chunks(links[n][0], links[n][1], chunk_data)
+
+    def _read_chunks(self, offset, size, chunk_data):
+        out = []
+        while size > 0:
+            chunk = offset//self.chlen
+            if chunk >= self.chcnt:
+                break
+            data = chunk_data(chunk)
+            # offset in the chunk
+            chofs = offset % self.chlen
+            part = data[chofs:chofs+size]
+            if not part:
+                break
+            out.append(part)
+            offset += len(part)
+            size -= len(part)
+        return b''.join(out)
+
+    def _chunk(self, chunk):
+        '''
+        returns decompressed chunk, recently used chunks
+        are kept in LRU cache limited by cache_size bytes
+        '''
+        data = self._cached(chunk)
+        if data is not None:
+            return data
+        data = self._inflate(chunk)
+        with self.lock:
+            if len(data) <= self.cache_size and chunk not in self.cache:
+                self.cache[chunk] = data
+                self.cache_bytes += len(data)
+                while self.cache_bytes > self.cache_size:
+                    old = self.cache.popitem(last=False)[1]
+                    self.cache_bytes -= len(old)
+                    self.evictions += 1
+        return data
+
+    def _cached(self, chunk):
+        'returns chunk from the cache or None counting a miss'
+        with self.lock:
+            data = self.cache.get(chunk)
+            if data is not None:
+                self.cache.move_to_end(chunk)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if metrics.enabled:
+            metrics.count('dictzip.cache_hits' if data is not None else 'dictzip.cache_misses')
+        return data
+
+    def _inflate(self, chunk):
+        # chunks end with a full flush, so each of them can be inflated
+        # on its own, a fresh inflater keeps threads independent
+        t = metrics.start()
+        compr = _pread(self.fd, self.lock, self.offsets[chunk], self.sizes[chunk])
+        data = zlib.decompressobj(-15).decompress(compr)
+        if t is not None:
+            metrics.stop('dictzip.chunk_read', t)
+            metrics.count('dictzip.bytes_read', len(compr))
+            metrics.count('dictzip.bytes_inflated', len(data))
+        return data
+
+    def cache_info(self):
+        'returns statistics of the chunk cache'
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'chunks': len(self.cache),
+                'bytes': self.cache_bytes, 'capacity': self.cache_size}
+
+    def cache_clear(self):
+        'drops all cached chunks and resets the counters'
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def view(self, offset, size):
+        'memoryview of size bytes at offset, see DictMmap.view()'
+        return memoryview(self.pread(offset, size))
+
+    def close(self):
+        self.cache_clear()
+        self.fd.close()
+
+
+def collation_key(word):
+    '''
+    sort key of words in .idx as StarDict does it, that is
+    g_ascii_strcasecmp() on UTF-8 bytes and strcmp() for ties;
+    the first part is the key used for searching
+    '''
+    b = word.encode('utf8')
+    return (b.lower(), b)
+
+
+class _View:
+    '''
+    values of get(i) as a read-only sequence, e.g. search keys
+    of an index for bisect, without building a list of them
+    '''
+    def __init__(self, get, count):
+        self.get = get
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return self.get(i)
+
+
+# parsers of .idx report progress every PROGRESS_STEP+1 words
+PROGRESS_STEP = 0xffff
+# numbers following each word in .idx, offsets into .dict
+# are 64 bit when .ifo has idxoffsetbits=64
+IDX_ENTRY = {32: struct.Struct('>LL'), 64: struct.Struct('>QL')}
+# array types of struct formats
+_TYPECODES = {'L': 'I', 'Q': 'Q'}
+
+
+class ListIndex:
+    '''
+    plain list of (word, (dict_index, length)) tuples
+    the whole .idx is decoded at once
+    '''
+    def __init__(self, fname=None, progress=None, offsetbits=32):
+        '''
+        progress(index, fraction) is called now and then while
+        .idx is parsed, words parsed so far can be searched already;
+        offsetbits is idxoffsetbits of .ifo
+        '''
+        self.idx = []
+        self.keys = []
+        if fname is None:
+            return
+        with open(fname, 'rb') as f:
+            data = f.read()
+        idx = self.idx
+        keys = self.keys
+        unpack_from = IDX_ENTRY[offsetbits].unpack_from
+        size = IDX_ENTRY[offsetbits].size
+        a = 0
+        b = data.find(b'\0', a)
+        while b > 0:
+            w = data[a:b]
+            idx.append((w.decode('utf8'), unpack_from(data, b+1)))
+            # keys go second, their length is the length of the index
+            keys.append(w.lower())
+            if progress is not None and not len(keys) & PROGRESS_STEP:
+                progress(self, b/len(data))
+            a = b+1+size
+            b = data.find(b'\0', a)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def word(self, index):
+        return self.idx[index][0]
+
+    def words(self, key):
+        return [w[0] for w in self.idx[key]]
+
+    def key(self, index):
+        return self.keys[index]
+
+    def bisect(self, key, lo=0, hi=None):
+        return bisect.bisect_left(self.keys, key, lo, len(self.keys) if hi is None else hi)
+
+    def link(self, index):
+        return self.idx[index][1]
+
+    def resident_size(self):
+        'approximate bytes held by the index, estimated from a sample'
+        count = len(self)
+        size = sys.getsizeof(self.idx)+sys.getsizeof(self.keys)
+        if not count:
+            return size
+        step = max(1, count//1000)
+        sample = 0
+        for i in range(0, count, step):
+            w, link = self.idx[i]
+            sample += (sys.getsizeof(self.idx[i])+sys.getsizeof(w)+sys.getsizeof(link)+
+                       sum(sys.getsizeof(v) for v in link)+sys.getsizeof(self.keys[i]))
+        return size + sample*count//len(range(0, count, step))
+
+    def close(self):
+        self.idx = []
+        self.keys = []
+
+
+def default_cache_dir():
+    'per user directory for index caches of read-only dictionaries'
+    base = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pyStarDictViewer')
+
+
+def atomic_write(path, write, strict=False):
+    '''
+    calls write(f) with a binary temporary file next to path,
+    which then replaces path, so readers never see a partial file;
+    returns False (path is left as it was) when it can't be written,
+    or raises the OSError when strict
+    '''
+    # unique for each thread, more of them may write the same file
+    tmp = '%s.%d-%d.tmp' % (path, os.getpid(), threading.get_ident())
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException as e:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        if isinstance(e, OSError) and not strict:
+            return False
+        raise
+    return True
+
+
+def cache_path(fname, ext, cache=True):
+    '''
+    where a cache file with extension ext belonging to fname is stored,
+    cache is True (next to fname or in default_cache_dir() when
+    that one is read-only) or a directory name
+    '''
+    name = os.path.splitext(fname)[0]+ext
+    if cache is True:
+        if os.access(os.path.dirname(os.path.abspath(name)), os.W_OK):
+            return name
+        cache = default_cache_dir()
+    # a name unique for the dictionary in a shared directory
+    digest = hashlib.sha1(os.path.abspath(fname).encode('utf8')).hexdigest()
+    base = os.path.basename(name)[:-len(ext)]
+    return os.path.join(cache, base+'-'+digest[:16]+ext)
+
+
+class MmapIndex:
+    '''
+    memory mapped .idx, only start positions of words and
+    their (dict_index, length) pairs are kept in typed arrays,
+    words themselves are decoded when asked for
+
+    when cache is given the arrays together with search keys
+    (see collation_key) are stored in a sidecar file and mapped
+    from there next time, so the .idx doesn't have to be parsed again;
+    cache is True (next to the dictionary or in default_cache_dir()
+    when it's read-only) or a directory name
+    '''
+    # numbers following each word
+    entry         = IDX_ENTRY[32]
+    cache_ext     = '.idxcache'
+    cache_magic   = b'PYSDIDX\0'
+    cache_version = 3
+    # magic, version, byte order, entry size, .idx size, .idx mtime,
+    # word count, keys length
+    cache_header  = struct.Struct('<8sHHHxxQqQQ')
+
+    def __init__(self, fname, cache=None, progress=None, offsetbits=32):
+        '''
+        progress(index, fraction) is called now and then while
+        .idx is parsed, words parsed so far can be searched already;
+        offsetbits is idxoffsetbits of .ifo
+        '''
+        if offsetbits != 32:
+            self.entry = IDX_ENTRY[offsetbits]
+        self.fd = open(fname, 'rb')
+        st = os.fstat(self.fd.fileno())
+        # positions in .idx (and in search keys, never longer)
+        self.typecode = 'I' if st.st_size <= 0xffffffff else 'Q'
+        if st.st_size:
+            self.data = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # empty file can't be mapped
+            self.data = b''
+        self.cache = None
+        self.kstarts = None
+        self.keys = None
+        path = self.cache_path(fname, cache) if cache else None
+        if path and self._load_cache(path, st):
+            return
+        self.starts = array(self.typecode)
+        self.fields = [array(t) for t in self._field_types()]
+        self._scan(progress)
+        if path and self._write_cache(path, st):
+            self._load_cache(path, st)
+
+    @property
+    def offsets(self):
+        return self.fields[0]
+
+    @property
+    def sizes(self):
+        return self.fields[1]
+
+    @classmethod
+    def cache_path(cls, fname, cache=True):
+        'where the cache of fname is stored'
+        return cache_path(fname, cls.cache_ext, cache)
+
+    def _field_types(self):
+        'array types of numbers following each word'
+        return [_TYPECODES[f] for f in self.entry.format[1:]]
+
+    def _scan(self, progress=None):
+        data = self.data
+        find = data.find
+        unpack_from = self.entry.unpack_from
+        size = self.entry.size
+        starts = self.starts
+        appends = [f.append for f in self.fields]
+        a = 0
+        b = find(b'\0', a)
+        while b > 0:
+            # a word counts (see __len__) once the start of the next one
+            # is known, its numbers are appended before that
+            for append, v in zip(appends, unpack_from(data, b+1)):
+                append(v)
+            starts.append(a)
+            if progress is not None and not len(starts) & PROGRESS_STEP:
+                progress(self, b/len(data))
+            a = b+1+size
+            b = find(b'\0', a)
+        # sentinel, so the end of the last word is known too
+        starts.append(a)
+
+    def _write_cache(self, path, st):
+        '''
+        writes arrays and search keys to the cache file,
+        returns False when it can't be written
+        '''
+        keys = bytearray()
+        kstarts = array(self.typecode, [0])
+        for i in range(len(self)):
+            keys += self.key(i)
+            kstarts.append(len(keys))
+        header = self.cache_header.pack(self.cache_magic, self.cache_version,
+                                        sys.byteorder == 'little', self.entry.size,
+                                        st.st_size, st.st_mtime_ns,
+                                        len(self), len(keys))
+        def write(f):
+            f.write(header)
+            for a in [self.starts]+self.fields+[kstarts]:
+                f.write(a.tobytes())
+            f.write(keys)
+        return atomic_write(path, write)
+
+    def _load_cache(self, path, st):
+        '''
+        maps arrays and search keys from the cache file,
+        returns False when there is none or it's stale
+        '''
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return False
+        with f:
+            header = f.read(self.cache_header.size)
+            if len(header) != self.cache_header.size:
+                return False
+            (magic, version, little, entrysize, size, mtime,
+             count, keyslen) = self.cache_header.unpack(header)
+            if (magic != self.cache_magic or version != self.cache_version or
+                    little != (sys.byteorder == 'little') or
+                    entrysize != self.entry.size or
+                    size != st.st_size or mtime != st.st_mtime_ns):
+                return False
+            fields = self._field_types()
+            types = [self.typecode] + fields + [self.typecode]
+            lengths = [count+1] + [count]*len(fields) + [count+1]
+            arrsize = sum(n*array(t).itemsize for t, n in zip(types, lengths))
+            if os.fstat(f.fileno()).st_size != self.cache_header.size + arrsize + keyslen:
+                return False
+            self.cache = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.cache)
+        pos = self.cache_header.size
+        arrays = []
+        for t, n in zip(types, lengths):
+            end = pos+n*array(t).itemsize
+            arrays.append(view[pos:end].cast(t))
+            pos = end
+        self.starts = arrays[0]
+        self.fields = arrays[1:-1]
+        self.kstarts = arrays[-1]
+        self.keys = view[pos:pos+keyslen]
+        return True
+
+    def __len__(self):
+        return len(self.starts)-1
+
+    def _word_end(self, index):
+        return self.starts[index+1]-1-self.entry.size
+
+    def word(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('index out of range')
+        return self.data[self.starts[index]:self._word_end(index)].decode('utf8')
+
+    def words(self, key):
+        return [self.word(i) for i in range(*key.indices(len(self)))]
+
+    def key(self, index):
+        'word bytes with ASCII letters lowered, used for searching'
+        if self.keys is None:
+            return self.data[self.starts[index]:self._word_end(index)].lower()
+        return self.keys[self.kstarts[index]:self.kstarts[index+1]].tobytes()
+
+    def bisect(self, key, lo=0, hi=None):
+        'position of the first word with search key not lower than key'
+        return bisect.bisect_left(_View(self.key, len(self)), key, lo, len(self) if hi is None else hi)
+
+    def link(self, index):
+        return (self.fields[0][index], self.fields[1][index])
+
+    def resident_size(self):
+        'bytes of arrays and mapped files (counted whole) of the index'
+        size = len(self.data)
+        if self.cache is not None:
+            return size+len(self.cache)
+        for a in [self.starts]+self.fields:
+            size += a.buffer_info()[1]*a.itemsize
+        return size
+
     def close(self):
+        # views into the cache must be released before it's closed
+        for v in [self.starts, self.kstarts, self.keys]+self.fields:
+            if isinstance(v, memoryview):
+                v.release()
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = b''
         self.fd.close()
+        self.starts = array(self.typecode, [0])
+        self.fields = [array(t) for t in self._field_types()]
+        self.kstarts = None
+        self.keys = None
+
+
+class SynIndex(MmapIndex):
+    '''
+    memory mapped .syn, synonyms (or other forms) of words
+    each of them followed by the index of its word in .idx
+    '''
+    entry     = struct.Struct('>L')
+    cache_ext = '.syncache'
+
+    def target(self, index):
+        'index of the word in .idx the synonym stands for'
+        return self.fields[0][index]
+
+    def link(self, index):
+        raise TypeError('synonyms have no translation, use target()')
+
+
+class OftIndex:
+    '''
+    low memory .idx, as StarDict itself does it only positions of
+    every page_size-th word are kept (and stored in .oft file next to
+    .idx or in the user cache directory), a page of words is decoded
+    when any of them is needed and a few recent pages are kept;
+    .oft offsets are 32 bit as StarDict writes them, so there is no
+    .oft for .idx over 4 GiB
+    '''
+    page_size    = 32
+    pages_cached = 8
+    oft_magic    = b"StarDict's Cache, Version: 0.2"
+
+    def __init__(self, fname, wordcount, cache=True, progress=None, offsetbits=32):
+        '''
+        progress(index, fraction) is called now and then while
+        .idx is scanned, words of pages scanned so far can be
+        searched already; offsetbits is idxoffsetbits of .ifo
+        '''
+        self.entry = IDX_ENTRY[offsetbits]
+        # .idx of 64 bit dictionaries may be over 4 GiB too
+        self.typecode = 'Q' if offsetbits == 64 else 'I'
+        self.fd = open(fname, 'rb')
+        st = os.fstat(self.fd.fileno())
+        if st.st_size:
+            self.data = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # empty file can't be mapped
+            self.data = b''
+        self.count = wordcount
+        self.lock = threading.Lock()
+        self.pages = OrderedDict()
+        npages = (wordcount-1)//self.page_size + 2 if wordcount else 1
+        paths = self.oft_paths(fname, cache) if cache else []
+        for path in paths:
+            if self._load_oft(path, st, npages):
+                return
+        self._scan(progress)
+        for path in paths:
+            if self._write_oft(path):
+                break
+
+    @classmethod
+    def oft_paths(cls, fname, cache=True):
+        'where StarDict looks for .oft of fname, in that order'
+        name = os.path.basename(fname)+'.oft'
+        if cache is not True:
+            return [os.path.join(cache, name)]
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        return [fname+'.oft', os.path.join(base, 'stardict', 'idx', name)]
+
+    def _scan(self, progress=None):
+        data = self.data
+        find = data.find
+        size = self.entry.size
+        self.offsets = array(self.typecode)
+        # only words of whole pages count until the end
+        self.count = 0
+        n = 0
+        a = 0
+        b = find(b'\0', a)
+        while b > 0:
+            if n % self.page_size == 0:
+                self.offsets.append(a)
+                if progress is not None and not n & PROGRESS_STEP:
+                    self.count = n
+                    progress(self, a/len(data))
+            n += 1
+            a = b+1+size
+            b = find(b'\0', a)
+        # sentinel, so the end of the last page is known too
+        self.offsets.append(a)
+        self.count = n
+
+    def _load_oft(self, path, st, npages):
+        '''
+        reads page offsets from .oft, returns False when
+        there is none or it's older than the .idx
+        '''
+        if st.st_size > 0xffffffff:
+            return False
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return False
+        with f:
+            if os.fstat(f.fileno()).st_mtime < st.st_mtime:
+                return False
+            if f.read(len(self.oft_magic)) != self.oft_magic:
+                return False
+            offsets = array('I')
+            try:
+                offsets.fromfile(f, npages)
+            except EOFError:
+                return False
+            if f.read(1) or offsets[-1] != st.st_size:
+                return False
+        self.offsets = offsets if self.typecode == 'I' else array(self.typecode, offsets)
+        return True
+
+    def _write_oft(self, path):
+        if self.offsets[-1] > 0xffffffff:
+            return False
+        offsets = self.offsets if self.typecode == 'I' else array('I', self.offsets)
+        def write(f):
+            f.write(self.oft_magic)
+            offsets.tofile(f)
+        return atomic_write(path, write)
+
+    def _page(self, p):
+        'returns (words, keys, links) of page p'
+        with self.lock:
+            page = self.pages.get(p)
+            if page is not None:
+                self.pages.move_to_end(p)
+                return page
+        data = self.data
+        unpack_from = self.entry.unpack_from
+        size = self.entry.size
+        words, keys, links = [], [], []
+        a, end = self.offsets[p], self.offsets[p+1]
+        while a < end:
+            b = data.find(b'\0', a)
+            w = data[a:b]
+            words.append(w)
+            keys.append(w.lower())
+            links.append(unpack_from(data, b+1))
+            a = b+1+size
+        page = (words, keys, links)
+        with self.lock:
+            self.pages[p] = page
+            if len(self.pages) > self.pages_cached:
+                self.pages.popitem(last=False)
+        return page
+
+    def _entry(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('index out of range')
+        return self._page(index//self.page_size), index % self.page_size
+
+    def _first_key(self, p):
+        a = self.offsets[p]
+        return self.data[a:self.data.find(b'\0', a)].lower()
+
+    def __len__(self):
+        return self.count
+
+    def word(self, index):
+        page, i = self._entry(index)
+        return page[0][i].decode('utf8')
+
+    def words(self, key):
+        return [self.word(i) for i in range(*key.indices(self.count))]
+
+    def key(self, index):
+        page, i = self._entry(index)
+        return page[1][i]
+
+    def bisect(self, key, lo=0, hi=None):
+        'position of the first word with search key not lower than key'
+        if hi is None:
+            hi = self.count
+        return max(lo, min(self._bisect(key), hi))
+
+    def _bisect(self, key):
+        # first page starting with a key not lower than key,
+        # the position is in the page before it or at its start
+        lo, hi = 0, len(self.offsets)-1
+        while lo < hi:
+            mid = (lo+hi)//2
+            if self._first_key(mid) < key:
+                lo = mid+1
+            else:
+                hi = mid
+        if lo == 0:
+            return 0
+        p = lo-1
+        i = bisect.bisect_left(self._page(p)[1], key)
+        return min(p*self.page_size+i, self.count)
+
+    def link(self, index):
+        page, i = self._entry(index)
+        return page[2][i]
+
+    def resident_size(self):
+        'bytes of page offsets, cached pages and mapped .idx (counted whole)'
+        size = len(self.data)+self.offsets.buffer_info()[1]*self.offsets.itemsize
+        with self.lock:
+            pages = list(self.pages.values())
+        for words, keys, links in pages:
+            size += sum(2*sys.getsizeof(w)+sys.getsizeof(l) for w, l in zip(words, links))
+        return size
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = b''
+        self.fd.close()
+        self.pages = OrderedDict()
+        self.offsets = array(self.typecode, [0])
+        self.count = 0
+
+
+class _LoadCancelled(Exception):
+    pass
 
 
 class StarDict:
-    def __init__(self, ifopath, load=True):
+    # 'list' decodes the whole .idx into a list of tuples,
+    # 'mmap' maps it and decodes words lazily,
+    # 'oft' keeps only offsets of pages of words
+    index_types = {'list': ListIndex, 'mmap': MmapIndex, 'oft': OftIndex}
+
+    def __init__(self, ifopath, load=True, index='mmap', cache=True, ifo=None):
+        '''
+        cache is used by 'mmap' index to keep parsed .idx in
+        a sidecar file, see MmapIndex, and by 'oft' index
+        for its .oft file, see OftIndex;
+        ifo is already parsed .ifo (see catalog.Catalog), then
+        the files are expected to be there and aren't checked
+        '''
         self.fname = ifopath[:-4]
-        self._check_files()
+        if index not in self.index_types:
+            raise ValueError('unknown index type: '+str(index))
+        self.index_type = index
+        self.cache = cache
+        self._check_files(ifo)
+        self.idx = ListIndex()
+        self.syn = None
+        self.dictf = None
+        # see load_async()
+        self.ready = threading.Event()
+        self.progress = 0.0
+        self.load_error = None
+        self._loader = None
+        self._cancel = threading.Event()
         if load:
             self.load()
-        else:
-            self.idx = []
 
-    def _check_files(self):
+    def _check_files(self, ifo=None):
         'loads .ifo information'
         'and checks all needed dictionary files are present'
         name = self.fname
-        self.ifo = {}
-        for l in open(name+'.ifo').readlines()[1:]:
-            pair = l.split('=')
-            self.ifo[pair[0]] = pair[1][:-1]
+        self.ifo = dict(ifo) if ifo is not None else read_ifo(name+'.ifo')
 
-        if (self.ifo['version'] not in ('2.4.2', '3.0.0') or
-                (self.ifo['sametypesequence'] != 'g' and self.ifo['sametypesequence'] != 'x') ):
+        if (self.ifo.get('version') not in ('2.4.2', '3.0.0') or
+                (self.ifo.get('sametypesequence') != 'g' and self.ifo.get('sametypesequence') != 'x') ):
             raise ValueError('unsupported StarDict')
+        self.offsetbits = int(self.ifo.get('idxoffsetbits', 32))
+        if self.offsetbits not in IDX_ENTRY:
+            raise ValueError('unsupported idxoffsetbits')
+
+        if ifo is not None:
+            # .syn is looked for when loading
+            self.has_syn = int(self.ifo.get('synwordcount', 0)) > 0
+            return
 
         if (not os.path.exists(name+'.idx')):
             raise ValueError('missing .idx file')
@@ -101,36 +931,129 @@ class StarDict:
             not os.path.exists(name+'.dict.dz')):
             raise ValueError('missing .dict file')
 
-    def load(self):
+        # synonyms are optional
+        self.has_syn = (int(self.ifo.get('synwordcount', 0)) > 0 and
+                        os.path.exists(name+'.syn'))
+
+    def load(self, progress=None):
         '''
-        from .idx builds a list of (word, (dict_index, length)) tuples
-        and opens .dict[.dz] file for reading
+        builds the word index from .idx (see index_types),
+        synonyms index from .syn if there is one
+        and opens .dict[.dz] file for reading;
+        progress(fraction) is called now and then while .idx is
+        parsed, when load_async() is running it waits for it;
+        nothing is done when it's loaded already
         '''
-        fname = self.fname+'.idx'
-        f = open(fname, 'rb')
-        flen = os.path.getsize(fname)
-        data = f.read(flen)
-        f.close()
-        self.idx = []
-        a = 0
-        b = data.find(b'\0', a)
-        while b > 0:
-            self.idx.append((data[a:b].decode('utf8'),
-                             struct.unpack('>LL', data[b+1:b+9])
-                             ))
-            a = b+9
-            b = data.find(b'\0', a)
-        assert int(self.ifo['wordcount']) == len(self.idx)
+        if self.loaded:
+            return
+        loader = self._loader
+        if loader is not None:
+            loader.join()
+            if self.load_error is not None:
+                raise self.load_error
+            return
+        self._load(progress)
+        self.ready.set()
+
+    def load_async(self, progress=None):
+        '''
+        loads on a worker thread, returns event `ready` which is set
+        when it's done (`load_error` is the exception if it failed);
+        words parsed so far can be searched and read meanwhile,
+        progress(fraction) is called from the worker thread,
+        the `progress` attribute can be polled instead
+        '''
+        if self.ready.is_set() or self._loader is not None:
+            return self.ready
+        self.load_error = None
+        self._loader = threading.Thread(target=self._load_thread, args=(progress,),
+                                        name='load '+os.path.basename(self.fname),
+                                        daemon=True)
+        self._loader.start()
+        return self.ready
+
+    def _load_thread(self, progress):
+        try:
+            self._load(progress)
+        except _LoadCancelled:
+            # unload() is waiting to release the rest
+            self._loader = None
+            return
+        except Exception as e:
+            self.load_error = e
+            self._release()
+        self._loader = None
+        self.ready.set()
+
+    def _load(self, progress):
+        t = metrics.start()
+        self.progress = 0.0
+
+        def report(index, fraction):
+            # the index grows in place, so it's searchable at once
+            self.idx = index
+            if self._cancel.is_set():
+                raise _LoadCancelled()
+            self.progress = fraction
+            if progress is not None:
+                progress(fraction)
+
+        # .dict goes first, so words found early can be read
         # compression of .dict is optional
         try:
-            self.dictf = open(self.fname+'.dict', 'rb')
+            self.dictf = open_dict(self.fname+'.dict')
         except OSError:
-            self.dictf = DictZip(self.fname+'.dict.dz') 
+            self.dictf = DictZip(self.fname+'.dict.dz')
+        bits = self.offsetbits
+        if self.index_type == 'mmap':
+            idx = MmapIndex(self.fname+'.idx', self.cache, report, bits)
+        elif self.index_type == 'oft':
+            idx = OftIndex(self.fname+'.idx', int(self.ifo['wordcount']), self.cache, report, bits)
+        else:
+            idx = self.index_types[self.index_type](self.fname+'.idx', report, bits)
+        self.idx = idx
+        assert int(self.ifo['wordcount']) == len(self.idx)
+        if self.has_syn and os.path.exists(self.fname+'.syn'):
+            self.syn = SynIndex(self.fname+'.syn', self.cache)
+            assert int(self.ifo['synwordcount']) == len(self.syn)
+        self.progress = 1.0
+        if progress is not None:
+            progress(1.0)
+        metrics.stop('load.'+self.index_type, t)
 
     def unload(self):
         'releases idx word list and opened .dict file'
-        self.idx = []
-        self.dictf.close()
+        loader = self._loader
+        if loader is not None:
+            # stop the load at its next progress report
+            self._cancel.set()
+            loader.join()
+            self._cancel.clear()
+        self.ready.clear()
+        self._release()
+
+    def _release(self):
+        self.idx.close()
+        self.idx = ListIndex()
+        if self.syn is not None:
+            self.syn.close()
+            self.syn = None
+        if self.dictf is not None:
+            self.dictf.close()
+            self.dictf = None
+
+    @property
+    def loaded(self):
+        return self.ready.is_set() and self.dictf is not None
+
+    def resident_size(self):
+        'approximate bytes held by the loaded dictionary, see resident_size of indexes'
+        size = self.idx.resident_size()
+        if self.syn is not None:
+            size += self.syn.resident_size()
+        if isinstance(self.dictf, DictZip):
+            size += self.dictf.cache_bytes
+        return size
 
     def __len__(self):
         return len(self.idx)
@@ -141,9 +1064,9 @@ class StarDict:
         string key is used for reverse lookup
         '''
         if type(key) is int:
-            return self.idx[key][0]
+            return self.idx.word(key)
         if type(key) is slice:
-            return [w[0] for w in self.idx[key]]
+            return self.idx.words(key)
         if type(key) is str:
             index = self.search(key)
             if index < 0:
@@ -155,52 +1078,130 @@ class StarDict:
         binary search for words in idx list
         when prefix=True it searches for the lowest record
         with 'word' as its prefix
+
+        ASCII letters are compared case insensitive as the .idx
+        is sorted (see collation_key), for other letters lower,
+        upper and capitalized variants of the word are tried;
+        synonyms from .syn are searched too, index of the word
+        they stand for is returned for them
         '''
-        print("in search(), search word:",word)
         if word == '':
             return -1
-        a, b = 0, len(self.idx)-1
-        if (b<0):
-             return -1
-        word = word.lower()
-        while a <= b:                
-            i = a+(b-a)//2
-            if prefix:
-            # searches words that include 'word' in their prefix
-                if self.idx[i][0].lower().startswith(word):
-                    if i and self.idx[i-1][0].lower().startswith(word):
-                        b = i-1
-                        continue
-                    else:
-                        return i
-            else:
-            # searches for entire match
-                if self.idx[i][0].lower() == word:
-                    return i
-            if a == b:
-                # no match
-                return -1
-            elif word > self.idx[i][0].lower():
-                # move upward
-                a = i+1
-            else:
-                # move downward
-                b = i-1
-        return -1
-    
+        t = metrics.start()
+        i = self._search(word, prefix)
+        if i < 0 and not word.isascii():
+            variants = (word.lower(), word.upper(), word[0].upper()+word[1:].lower())
+            for w in variants:
+                if w != word:
+                    i = self._search(w, prefix)
+                    if i >= 0:
+                        break
+        if t is not None:
+            metrics.stop('search.prefix' if prefix else 'search.exact', t)
+            if i < 0:
+                metrics.count('search.misses')
+        return i
+
+    def _search(self, word, prefix):
+        key = collation_key(word)[0]
+        i = self._find(self.idx, key, word, prefix)
+        if self.syn is None:
+            return i
+        j = self._find(self.syn, key, word, prefix)
+        if j < 0:
+            return i
+        # for prefix the lower of both matches, words win the tie
+        if i < 0 or (prefix and self.syn.key(j) < self.idx.key(i)):
+            return self.syn.target(j)
+        return i
+
+    @staticmethod
+    def _find(idx, key, word, prefix):
+        'position of word (or key prefix) in idx, -1 when missing'
+        i = idx.bisect(key)
+        if i >= len(idx):
+            return -1
+        if prefix:
+            return i if idx.key(i).startswith(key) else -1
+        # prefer exact match among words differing in case of ASCII letters
+        j = i
+        while j < len(idx) and idx.key(j) == key:
+            if idx.word(j) == word:
+                return j
+            j += 1
+        return i if j > i else -1
+
+    def fuzzy_search(self, word, maxdist=None, limit=10):
+        '''
+        words within maxdist edits (Levenshtein distance) of word,
+        returns up to limit (index, distance) tuples, closest first;
+        see FuzzySearch.search for default maxdist
+        '''
+        if word == '':
+            return []
+        return FuzzySearch(self.idx).search(word, maxdist, limit)
+
+    def lookup_many(self, words, prefix=False, max_chunks=8):
+        '''
+        searches all words and reads their translations at once,
+        returns (index, translation) tuples in order of words,
+        None for words not found;
+        translations are read ordered by their position in .dict,
+        so each chunk of .dict.dz is decompressed only once and
+        at most max_chunks of them are held in memory
+        '''
+        indexes = [self.search(w, prefix) for w in words]
+        found = sorted(set(i for i in indexes if i >= 0))
+        data = self.dictf.pread_many([self.idx.link(i) for i in found], max_chunks)
+        data = dict(zip(found, data))
+        return [(i, data[i]) if i >= 0 else None for i in indexes]
+
+    def iter_data(self, max_chunks=8):
+        '''
+        yields (index, translation) of all words in order of
+        their position in .dict, so each chunk is decompressed once
+        '''
+        links = _View(self.idx.link, len(self.idx))
+        return self.dictf.iter_pread(links, max_chunks)
+
     def dict_link(self, index):
         'returns (dict_index, len) tuple of a word on a given index'
-        return self.idx[index][1]
+        return self.idx.link(index)
 
     def dict_data(self, index):
         'returns translation for a word on the given index'
-        self.dictf.seek(self.idx[index][1][0])
-        return self.dictf.read(self.idx[index][1][1])
+        t = metrics.start()
+        offset, size = self.idx.link(index)
+        data = self.dictf.pread(offset, size)
+        metrics.stop('dict_data', t)
+        return data
+
+    def dict_view(self, index):
+        '''
+        translation for a word on the given index as a memoryview,
+        of the mapped file when .dict is uncompressed (see DictMmap)
+        '''
+        t = metrics.start()
+        offset, size = self.idx.link(index)
+        data = self.dictf.view(offset, size)
+        metrics.stop('dict_data', t)
+        return data
 
     def __str__(self):
         return str(self.ifo)
 
 
+def read_ifo(path):
+    'key=value pairs of .ifo file as a dict'
+    ifo = {}
+    with open(path, encoding='utf8') as f:
+        for l in f.readlines()[1:]:
+            key, sep, value = l.rstrip('\r\n').partition('=')
+            if sep:
+                ifo[key] = value
+    return ifo
+
+
 def look_for_dicts(path):
     '''
     explores all subdirectories of path searching for filenames
@@ -214,8 +1215,7 @@ def look_for_dicts(path):
             name = f[:-4]
             if (name+'.idx' in files and (name+'.dict.dz' in files
                                           or name+'.dict' in files)):
-                #names.append(root+'/'+name+'.ifo')
-                names.append(root+'\\'+name+'.ifo')
+                names.append(os.path.join(root, name+'.ifo'))
     return names
         
 
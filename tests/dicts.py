@@ -0,0 +1,63 @@
+'''
+dictionaries the tests run on: small synthetic ones written by
+writer.write() into a temporary directory and the bundled ones
+'''
+import os
+import sys
+import glob
+import random
+import struct
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import stardict as sdict
+import writer
+
+BUNDLED = sorted(glob.glob(os.path.join(os.path.dirname(HERE), 'dic', '*', '*.ifo')))
+INDEX_TYPES = sorted(sdict.StarDict.index_types)
+
+# ASCII letters of both cases, letters StarDict doesn't fold and a few
+# characters sorting before and between letters
+LETTERS = 'abcdeABCDE' + 'čéÉŽž' + ' -_'
+
+
+def random_words(count, seed=1):
+    'count different words, some of them differing only in case'
+    rnd = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        w = ''.join(rnd.choice(LETTERS) for n in range(rnd.randint(1, 8))).strip()
+        if not w:
+            continue
+        words.add(w)
+        if rnd.random() < 0.1:
+            words.add(rnd.choice((w.upper(), w.lower(), w.capitalize())))
+    return sorted(words)[:count]
+
+
+def definition(word):
+    return '<b>%s</b> means %s' % (word, word[::-1])
+
+
+def write(path, words, **kw):
+    'writes words with their definitions in random order, returns .ifo'
+    pairs = [(w, definition(w)) for w in words]
+    random.Random(len(words)).shuffle(pairs)
+    return writer.write(path, pairs, **kw)
+
+
+def write_syn(ifo, synonyms):
+    '''
+    adds .syn of (synonym, index of its word) to dictionary ifo
+    (written without it), sorted as StarDict expects
+    '''
+    base = ifo[:-len('.ifo')]
+    synonyms = sorted(synonyms, key=lambda s: sdict.collation_key(s[0]))
+    with open(base+'.syn', 'wb') as f:
+        for word, i in synonyms:
+            f.write(word.encode('utf8')+b'\0'+struct.pack('>L', i))
+    with open(ifo, encoding='utf8') as f:
+        lines = f.read().splitlines()
+    with open(ifo, 'w', encoding='utf8') as f:
+        f.write('\n'.join(lines+['synwordcount=%d' % len(synonyms)])+'\n')
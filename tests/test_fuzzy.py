@@ -0,0 +1,88 @@
+'''
+FuzzySearch against Levenshtein distance to every word
+'''
+import random
+import tempfile
+import unittest
+
+import dicts
+import stardict as sdict
+from fuzzy import FuzzySearch
+
+
+def distance(a, b):
+    row = list(range(len(b)+1))
+    for i, c in enumerate(a, 1):
+        prev, row[0] = row[0], i
+        for j, e in enumerate(b, 1):
+            prev, row[j] = row[j], min(row[j]+1, row[j-1]+1, prev+(c != e))
+    return row[-1]
+
+
+class Brute:
+    'what FuzzySearch.search returns, by comparing word with each key'
+    def __init__(self, keys, word):
+        self.keys = keys
+        # search keys have only ASCII letters lowered
+        self.word = word.encode('utf8').lower().decode('utf8')
+        self.hits = [(i, distance(k, self.word)) for i, k in enumerate(keys)]
+
+    def search(self, maxdist, limit):
+        hits = [h for h in self.hits if h[1] <= maxdist]
+        hits.sort(key=lambda h: (h[1], abs(len(self.keys[h[0]])-len(self.word)), h[0]))
+        return hits[:limit]
+
+
+def typos(word, rnd):
+    'word with a letter changed, added or left out'
+    n = rnd.randrange(len(word)+1)
+    c = rnd.choice(dicts.LETTERS)
+    return rnd.choice((word[:n]+c+word[n+1:], word[:n]+c+word[n:], word[:n]+word[n+1:]))
+
+
+class FuzzyTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.ifo = dicts.write(cls.tmp.name+'/t', dicts.random_words(1500))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_brute_force(self):
+        rnd = random.Random(6)
+        for index in dicts.INDEX_TYPES:
+            d = sdict.StarDict(self.ifo, index=index)
+            try:
+                keys = [d.idx.key(i).decode('utf8') for i in range(len(d))]
+                words = [typos(w, rnd) for w in rnd.sample(d[:], 30)]
+                words += [typos(w, rnd).upper() for w in words[:5]] + ['x', 'abcdeabcde']
+                fuzzy = FuzzySearch(d.idx)
+                for word in words:
+                    brute = Brute(keys, word)
+                    for maxdist in (0, 1, 2):
+                        self.assertEqual(fuzzy.search(word, maxdist, len(d)),
+                                         brute.search(maxdist, len(d)), (index, word, maxdist))
+                    self.assertEqual(fuzzy.search(word, 2, 5), brute.search(2, 5))
+            finally:
+                d.unload()
+
+    def test_default_distance(self):
+        # 2 edits only for longer words with nothing 1 edit away
+        d = sdict.StarDict(self.ifo)
+        try:
+            keys = [d.idx.key(i).decode('utf8') for i in range(len(d))]
+            for word in ('zzzzz', 'zzzz', d[10]+'zz', d[10]+'z'):
+                brute = Brute(keys, word)
+                hits = brute.search(1, 10)
+                if not hits and len(word) > 4:
+                    hits = brute.search(2, 10)
+                self.assertEqual(d.fuzzy_search(word), hits, word)
+            self.assertEqual(d.fuzzy_search(''), [])
+        finally:
+            d.unload()
+
+
+if __name__ == '__main__':
+    unittest.main()
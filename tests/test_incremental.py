@@ -0,0 +1,80 @@
+'''
+IncrementalSearch against StarDict.search with prefix=True
+while words are typed, deleted and replaced
+'''
+import random
+import tempfile
+import unittest
+
+import dicts
+import stardict as sdict
+from incremental import IncrementalSearch
+
+
+def typing(words, rnd):
+    'entry texts of typing words letter by letter with corrections'
+    for w in words:
+        text = ''
+        for c in w:
+            text += c
+            yield text
+            r = rnd.random()
+            if r < 0.1:
+                # a typo corrected
+                yield text+rnd.choice(dicts.LETTERS)
+            elif r < 0.15:
+                text = text[:rnd.randrange(len(text)+1)]
+                yield text
+        yield text.upper()
+        # the entry selected and replaced
+        yield w[:1]
+
+
+class IncrementalTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        words = dicts.random_words(1500)
+        cls.ifo = dicts.write(cls.tmp.name+'/t', words)
+        cls.syn_ifo = dicts.write(cls.tmp.name+'/s', words)
+        rnd = random.Random(9)
+        other = set(dicts.random_words(300, seed=10))-set(words)
+        dicts.write_syn(cls.syn_ifo, [(w, rnd.randrange(len(words))) for w in other])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_typing(self):
+        for ifo in (self.ifo, self.syn_ifo):
+            for index in dicts.INDEX_TYPES:
+                d = sdict.StarDict(ifo, index=index)
+                try:
+                    rnd = random.Random(11)
+                    words = rnd.sample(d[:], 100) + ['žába', 'ŽAB', 'zzz']
+                    if d.syn is not None:
+                        words += [d.syn.word(i) for i in range(0, len(d.syn), 10)]
+                    inc = IncrementalSearch(d)
+                    for text in typing(words, rnd):
+                        self.assertEqual(inc.search(text), d.search(text, True),
+                                         (ifo, index, text))
+                    self.assertEqual(inc.search(''), -1)
+                finally:
+                    d.unload()
+
+    def test_reloaded(self):
+        # searches go on after the dictionary is loaded again
+        d = sdict.StarDict(self.ifo)
+        try:
+            inc = IncrementalSearch(d)
+            word = d[len(d)//2]
+            self.assertEqual(inc.search(word[:1]), d.search(word[:1], True))
+            d.unload()
+            d.load()
+            self.assertEqual(inc.search(word), d.search(word, True))
+        finally:
+            d.unload()
+
+
+if __name__ == '__main__':
+    unittest.main()
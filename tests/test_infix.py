@@ -0,0 +1,89 @@
+'''
+InfixIndex against looking for the text in every word
+'''
+import random
+import tempfile
+import unittest
+
+import dicts
+import stardict as sdict
+from infix import InfixIndex, Matches
+
+
+def brute(words, text, start=0):
+    text = text.lower()
+    return [i for i in range(start, len(words)) if text in words[i].lower()]
+
+
+def texts(words, rnd, count):
+    'parts of words of 1 to 5 letters and a few of no word'
+    out = []
+    for w in rnd.sample(words, count):
+        n = rnd.randrange(len(w))
+        out.append(w[n:n+rnd.randint(1, 5)])
+    return out + [t.upper() for t in out[:5]] + ['zzz', 'qq', 'abcdeabcde']
+
+
+class InfixTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.ifo = dicts.write(cls.tmp.name+'/t', dicts.random_words(2000))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def check(self, d, index, texts, rnd):
+        words = d[:]
+        for text in texts:
+            self.assertEqual(index.search(text), brute(words, text), text)
+            start = rnd.randrange(len(d))
+            self.assertEqual(index.search(text, start, 10), brute(words, text, start)[:10], text)
+
+    def test_brute_force(self):
+        rnd = random.Random(7)
+        d = sdict.StarDict(self.ifo)
+        try:
+            built = InfixIndex.open(d, self.tmp.name)
+            # the second one is read from the file the first one wrote
+            stored = InfixIndex.open(d, self.tmp.name)
+            self.assertIsNotNone(stored.data)
+            for index in (built, stored):
+                self.check(d, index, texts(d[:], rnd, 100), rnd)
+                index.close()
+        finally:
+            d.unload()
+
+    def test_matches(self):
+        d = sdict.StarDict(self.ifo)
+        try:
+            index = InfixIndex.open(d, False)
+            m = Matches(d, index.iter_search('a'))
+            while m.fetch(100):
+                self.assertEqual(len(m) % 100, 0)
+            self.assertTrue(m.done)
+            self.assertEqual(m.indexes, brute(d[:], 'a'))
+            m = Matches(d, index.iter_search('a'))
+            m.fetch(10)
+            m.close()
+            self.assertFalse(m.fetch(10))
+            self.assertEqual(len(m), 10)
+            index.close()
+        finally:
+            d.unload()
+
+    def test_bundled(self):
+        rnd = random.Random(8)
+        for ifo in dicts.BUNDLED:
+            d = sdict.StarDict(ifo)
+            try:
+                index = InfixIndex.open(d, self.tmp.name)
+                self.check(d, index, texts(d[:], rnd, 10), rnd)
+                index.close()
+            finally:
+                d.unload()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+'''
+StarDict.search() and collation_key() against the .idx order and a
+linear scan of the words, for all index types
+'''
+import random
+import tempfile
+import unittest
+
+import dicts
+import stardict as sdict
+
+
+def key(word):
+    return sdict.collation_key(word)[0]
+
+
+def scan(words, keys, word, prefix):
+    'position of word in words as search() finds it, by looking at each'
+    k = key(word)
+    if prefix:
+        return next((i for i, wk in enumerate(keys) if wk.startswith(k)), -1)
+    same = [i for i, wk in enumerate(keys) if wk == k]
+    exact = [i for i in same if words[i] == word]
+    return (exact or same or [-1])[0]
+
+
+def baseline(words, synonyms, searches):
+    '''
+    what search() returns for each (word, prefix) of searches: words
+    are searched, then synonyms (pairs (synonym, index) in .syn order),
+    then case variants of the word
+    '''
+    keys = [key(w) for w in words]
+    syns = [s for s, t in synonyms]
+    syn_keys = [key(s) for s in syns]
+    found = []
+    for word, prefix in searches:
+        variants = [word]
+        if not word.isascii():
+            variants += [word.lower(), word.upper(), word[0].upper()+word[1:].lower()]
+        result = -1
+        for w in variants:
+            i = scan(words, keys, w, prefix)
+            j = scan(syns, syn_keys, w, prefix)
+            if j >= 0 and (i < 0 or prefix and syn_keys[j] < keys[i]):
+                result = synonyms[j][1]
+            elif i >= 0:
+                result = i
+            if result >= 0:
+                break
+        found.append(result)
+    return found
+
+
+def queries(words, seed=2):
+    rnd = random.Random(seed)
+    out = list(words)
+    for w in rnd.sample(words, 200):
+        out += [w[:rnd.randint(1, len(w))], w.upper(), w.lower(), w.swapcase()]
+    out += [''.join(rnd.choice(dicts.LETTERS) for n in range(4)) for n in range(200)]
+    return out
+
+
+class CollationTest(unittest.TestCase):
+    def test_order(self):
+        # ASCII case folded, then bytes; other letters after ASCII ones
+        words = ['_x', 'Apple', 'apple', 'apples', 'b', 'Zed', 'zed', 'Ärger', 'éra']
+        self.assertEqual(sorted(reversed(words), key=sdict.collation_key), words)
+
+    def test_bundled_idx_order(self):
+        for ifo in dicts.BUNDLED:
+            d = sdict.StarDict(ifo)
+            try:
+                keys = [sdict.collation_key(w) for w in d[:]]
+                self.assertEqual(keys, sorted(keys), ifo)
+            finally:
+                d.unload()
+
+
+class SearchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.ifo = dicts.write(cls.tmp.name+'/t', dicts.random_words(1500))
+        d = sdict.StarDict(cls.ifo, index='list')
+        cls.words = d[:]
+        d.unload()
+        rnd = random.Random(3)
+        other = set(dicts.random_words(300, seed=5))-set(cls.words)
+        cls.synonyms = [(w, rnd.randrange(len(cls.words))) for w in sorted(other)]
+        cls.synonyms.sort(key=lambda s: sdict.collation_key(s[0]))
+        cls.syn_ifo = dicts.write(cls.tmp.name+'/s', cls.words)
+        dicts.write_syn(cls.syn_ifo, cls.synonyms)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def check(self, ifo, synonyms):
+        searches = [(word, prefix) for word in queries(self.words+[s for s, i in synonyms])
+                    for prefix in (False, True)]
+        expected = baseline(self.words, synonyms, searches)
+        for index in dicts.INDEX_TYPES:
+            d = sdict.StarDict(ifo, index=index)
+            try:
+                self.assertEqual(d[:], self.words)
+                for (word, prefix), i in zip(searches, expected):
+                    self.assertEqual(d.search(word, prefix), i, (index, word, prefix))
+            finally:
+                d.unload()
+
+    def test_words(self):
+        self.check(self.ifo, [])
+
+    def test_synonyms(self):
+        self.check(self.syn_ifo, self.synonyms)
+
+    def test_empty(self):
+        d = sdict.StarDict(self.ifo)
+        try:
+            self.assertEqual(d.search(''), -1)
+            self.assertEqual(d.search('', True), -1)
+        finally:
+            d.unload()
+
+    def test_bundled(self):
+        # the first of the words equal to the found one, found by prefixes too
+        for ifo in dicts.BUNDLED:
+            d = sdict.StarDict(ifo)
+            try:
+                for i in random.Random(4).sample(range(len(d)), 300):
+                    word = d[i]
+                    j = d.search(word)
+                    self.assertEqual(d[j], word)
+                    self.assertTrue(j == 0 or d[j-1] != word)
+                    k = key(word[:3])
+                    j = d.search(word[:3], True)
+                    self.assertTrue(key(d[j]).startswith(k), word)
+                    self.assertTrue(j == 0 or not key(d[j-1]).startswith(k), word)
+            finally:
+                d.unload()
+
+
+if __name__ == '__main__':
+    unittest.main()
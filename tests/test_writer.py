@@ -0,0 +1,72 @@
+'''
+dictionaries written by writer read back by StarDict,
+with 32 and 64 bit offsets, compressed or not
+'''
+import os
+import gzip
+import tempfile
+import unittest
+
+import dicts
+import stardict as sdict
+import writer
+
+
+class WriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.words = dicts.random_words(2000)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def check(self, ifo, words, index='mmap'):
+        d = sdict.StarDict(ifo, index=index)
+        try:
+            self.assertEqual(d[:], sorted(words, key=sdict.collation_key))
+            for i, w in enumerate(d[:]):
+                self.assertEqual(bytes(d.dict_view(i)).decode('utf8'), dicts.definition(w))
+            found = dict(d.lookup_many(words[::7]))
+            self.assertEqual(len(found), len(words[::7]))
+        finally:
+            d.unload()
+
+    def test_round_trip(self):
+        for bits in (32, 64):
+            for compress in (True, False):
+                # tiny runs and chunks, so runs are merged and chunks read across
+                path = os.path.join(self.tmp.name, 'd%d%s' % (bits, 'z' if compress else ''))
+                ifo = dicts.write(path, self.words, offsetbits=bits, compress=compress,
+                                  run_size=100, chunk_size=256, workers=1)
+                self.assertEqual(sdict.StarDict(ifo, load=False).ifo.get('idxoffsetbits', '32'),
+                                 str(bits))
+                self.assertEqual(os.path.exists(path+'.dict.dz'), compress)
+                for index in dicts.INDEX_TYPES:
+                    self.check(ifo, self.words, index)
+
+    def test_repack(self):
+        ifo = dicts.write(os.path.join(self.tmp.name, 'a'), self.words)
+        again = writer.write(os.path.join(self.tmp.name, 'b'), writer._stardict_pairs(ifo),
+                             offsetbits=64)
+        self.check(again, self.words)
+
+    def test_dictzip(self):
+        src = os.path.join(self.tmp.name, 'data')
+        with open(src, 'wb') as f:
+            f.write(os.urandom(5000)+bytes(5000))
+        writer.write_dictzip(src, src+'.dz', chunk_size=100, workers=2)
+        with gzip.open(src+'.dz') as f, open(src, 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_too_many_chunks(self):
+        # XLEN is 10+2*count bytes, 32763 chunks don't fit in it
+        src = os.path.join(self.tmp.name, 'data')
+        with open(src, 'wb') as f:
+            f.write(bytes(16*32763))
+        with self.assertRaises(ValueError):
+            writer.write_dictzip(src, src+'.dz', chunk_size=16)
+        writer.write_dictzip(src, src+'.dz', chunk_size=16*2, workers=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,6 +16,7 @@ class WordIndexWindow(tk.Frame):
         tk.Frame.__init__(self, master)
 
         self.lbox     = tk.Listbox(self, height=height, exportselection=0)
+        self.sbar     = tk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
         self.items    = items
         self.itemcnt  = len(items)
         self.winsize  = height
@@ -26,11 +27,20 @@ class WordIndexWindow(tk.Frame):
         self.select   = -1
         self.style    = self.lbox['activestyle']
         self.callback = callback
+        # index of the item in the first row of the listbox
+        self.shown    = 0
+        self.pending  = None
+        self.relist   = False
+        # called when rows reach the last page of items, so more
+        # of them can be added (see refresh)
+        self.near_end = None
 
         self.lbox.insert(tk.END, *items[self.top : self.bot+1])
         self.lbox.activate(0)
         self.lbox.select_anchor(0)
-        self.lbox.pack()
+        self.lbox.pack(side=tk.LEFT)
+        self.sbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self._set_scrollbar()
         
         self.lbox.bind('<KeyRelease-Return>' , self._on_enter)
         self.lbox.bind('<KeyRelease-space>'  , self._on_enter)
@@ -57,10 +67,30 @@ class WordIndexWindow(tk.Frame):
         keysym = 'Up'
 
     def _redraw(self, relist=True):
-        if relist:
-            self.lbox.delete(0, tk.END)
-            self.lbox.insert(0, *self.items[self.top : self.bot+1])
-        
+        '''
+        redraws when Tk is idle, so more scroll steps
+        or moves meanwhile are drawn at once
+        '''
+        self.relist = self.relist or relist
+        if self.pending is None:
+            self.pending = self.after_idle(self._draw)
+
+    def _flush(self):
+        'draws a pending redraw now'
+        if self.pending is not None:
+            self.after_cancel(self.pending)
+            self._draw()
+
+    def _draw(self):
+        self.pending = None
+        if self.relist:
+            self._shift_rows()
+            self.relist = False
+            self._set_scrollbar()
+            if self.near_end is not None and self.bot >= self.itemcnt-self.winsize:
+                self.after_idle(self.near_end)
+
+        self.lbox.select_clear(0, tk.END)
         if (self.top <= self.select <= self.bot):
             self.lbox.select_set(self.select - self.top)
 
@@ -75,6 +105,50 @@ class WordIndexWindow(tk.Frame):
             # area with active item
             self.lbox['activestyle'] = 'none'
 
+    def _shift_rows(self):
+        '''
+        makes rows show items from top to bot, rows still visible
+        are kept and only words of the others are fetched
+        '''
+        top = self.top
+        bot = min(self.bot, self.itemcnt-1)
+        old_top = self.shown
+        old_bot = old_top + self.lbox.size()-1
+        if bot < top or bot < old_top or top > old_bot:
+            self.lbox.delete(0, tk.END)
+            if bot >= top:
+                self.lbox.insert(0, *self.items[top : bot+1])
+        else:
+            if top > old_top:
+                self.lbox.delete(0, top-old_top-1)
+            elif top < old_top:
+                self.lbox.insert(0, *self.items[top : old_top])
+            if bot < old_bot:
+                self.lbox.delete(bot-top+1, tk.END)
+            elif bot > old_bot:
+                self.lbox.insert(tk.END, *self.items[old_bot+1 : bot+1])
+        self.shown = top
+
+    def _set_scrollbar(self):
+        if self.itemcnt:
+            self.sbar.set(self.top/self.itemcnt, min(self.bot+1, self.itemcnt)/self.itemcnt)
+        else:
+            self.sbar.set(0, 1)
+
+    def _move(self, top):
+        'shows items from top, in constant time wherever it is'
+        top = max(0, min(top, self.itemcnt - self.winsize))
+        self.top = top
+        self.bot = top + self.winsize-1
+        self._redraw()
+
+    def _on_scrollbar(self, *args):
+        if args[0] == 'moveto':
+            self._move(int(float(args[1])*self.itemcnt))
+        elif args[0] == 'scroll':
+            step = self.winsize-1 if args[2] == 'pages' else 1
+            self._move(self.top + int(args[1])*step)
+
     def _on_scroll(self, event):
         if event.num == 5 or event.delta < 0:
             # DOWN
@@ -94,7 +168,8 @@ class WordIndexWindow(tk.Frame):
         # this is after mouse is released and newly active item has been
         # already chosen by the Listbox itself and is marked under ANCHOR
         #self.select = self.top+self.lbox.index(tk.ANCHOR)
-        self.select = self.top + int(self.lbox.curselection()[0])
+        # the row clicked shows what was drawn, not what may be pending
+        self.select = self.shown + int(self.lbox.curselection()[0])
         self.active = self.select
         self._redraw(False)
         self.callback(self.select)
@@ -103,6 +178,7 @@ class WordIndexWindow(tk.Frame):
     def _on_enter(self, event):
         # space or enter is released, old selection must be manually removed
         # and new selection will be where now active item is
+        self._flush()
         self.lbox.select_clear(self.select - self.top)
         self.select = self.top + self.lbox.index(tk.ACTIVE)
         self.active = self.select
@@ -175,7 +251,11 @@ class WordIndexWindow(tk.Frame):
         return 'break'
 
     def _on_ctrl_endhome(self, event):
-        print(event.keysym)
+        if event.keysym == 'End':
+            self.active = max(self.itemcnt-1, 0)
+        else:
+            self.active = 0
+        self._move(self.active)
         return 'break'
 
     def focus(self):
@@ -188,9 +268,19 @@ class WordIndexWindow(tk.Frame):
         self.select = -1
         self.top     = 0
         self.bot     = min(self.winsize-1, self.itemcnt)
+        # rows show other items now
+        self.lbox.delete(0, tk.END)
+        self._redraw()
+
+    def refresh(self):
+        'takes into account items added to the end of items'
+        self.itemcnt = len(self.items)
+        self.bot = min(self.top + self.winsize-1, self.itemcnt)
         self._redraw()
 
     def see(self, index, centered=False):
+        # items may have grown meanwhile (dictionary still loading)
+        self.itemcnt = len(self.items)
         if index >= self.itemcnt:
             index = self.itemcnt-1
         elif index < 0:
@@ -0,0 +1,307 @@
+'''
+writing of StarDict dictionaries
+
+Writer takes headwords with their definitions in any order. Definitions
+are appended to .dict right away, headwords with links to them are
+collected in runs which are sorted in StarDict order (see
+stardict.collation_key) and flushed to temporary files when they grow,
+the runs are merged into .idx at the end, so dictionaries larger than
+memory can be written. .dict is then compressed into .dict.dz, its
+chunks are independent, so they are deflated on a pool of processes.
+
+    python writer.py source.ifo target   # re-packs a dictionary
+    python writer.py words.tab target    # headword<TAB>definition lines
+'''
+import os
+import sys
+import time
+import zlib
+import heapq
+import shutil
+import struct
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import stardict as sdict
+
+
+def _deflate(data, level, last):
+    '''
+    raw deflate of one dictzip chunk, it ends with a full flush
+    (the last one finishes the stream) so chunks compressed
+    separately can be concatenated and inflated one by one
+    '''
+    comp = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return comp.compress(data)+comp.flush(zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+
+
+def _deflated(chunks, level, workers):
+    'compressed (data, last) chunks in their order'
+    if workers <= 1:
+        for data, last in chunks:
+            yield _deflate(data, level, last)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        # a few chunks per worker in flight, not the whole file
+        pending = deque()
+        for data, last in chunks:
+            pending.append(pool.submit(_deflate, data, level, last))
+            if len(pending) >= 4*workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_dictzip(src, dst, chunk_size=58315, level=6, workers=None):
+    '''
+    compresses file src into dictzip dst with chunks of chunk_size
+    bytes, workers processes compress them (all CPUs by default)
+    '''
+    size = os.path.getsize(src)
+    count = max(1, -(-size//chunk_size))
+    # XLEN holds the RA subfield header too
+    if not 0 < chunk_size <= 0xffff or 10+2*count > 0xffff:
+        raise ValueError('too many chunks, use bigger chunk_size')
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, count)
+    crc = 0
+    sizes = []
+    with open(src, 'rb') as fin, open(dst+'.tmp', 'wb') as fout:
+        # the RA field as DictZip reads it: version, chunk length,
+        # chunk count and compressed sizes of chunks, known at the end
+        extra = struct.pack('<2sHHHH', b'RA', 6+2*count, 1, chunk_size, count)
+        header = (b'\x1f\x8b\x08\x04'+struct.pack('<I', int(time.time()))+
+                  b'\x00\x03'+struct.pack('<H', len(extra)+2*count)+extra)
+        fout.write(header+bytes(2*count))
+
+        def chunks():
+            nonlocal crc
+            for n in range(count):
+                data = fin.read(chunk_size)
+                crc = zlib.crc32(data, crc)
+                yield data, n == count-1
+
+        for out in _deflated(chunks(), level, workers):
+            if len(out) > 0xffff:
+                raise ValueError('chunk too big when compressed, use smaller chunk_size')
+            sizes.append(len(out))
+            fout.write(out)
+        fout.write(struct.pack('<II', crc, size & 0xffffffff))
+        fout.seek(len(header))
+        fout.write(struct.pack('<%dH' % count, *sizes))
+    os.replace(dst+'.tmp', dst)
+
+
+# run file record: word length, seq, offset, size, then the word
+_RUN = struct.Struct('<IQQL')
+
+
+def _write_run(entries, f):
+    for key, word, seq, offset, size in entries:
+        f.write(_RUN.pack(len(word), seq, offset, size)+word)
+
+
+def _read_run(f):
+    'yields entries of a run file in the form they were collected'
+    while True:
+        head = f.read(_RUN.size)
+        if not head:
+            return
+        n, seq, offset, size = _RUN.unpack(head)
+        w = f.read(n)
+        yield w.lower(), w, seq, offset, size
+
+
+class Writer:
+    '''
+    writes dictionary path.ifo, .idx and .dict.dz (.dict when compress
+    is False) from headwords and definitions given by add(); offsetbits
+    are 32 or 64 (idxoffsetbits of .ifo), needed for .dict over 4 GiB;
+    other keyword arguments (author, description, ...) go to .ifo
+
+    definitions are stored in the order they are added, entries
+    with the same headword are kept in that order too
+    '''
+    chunk_size = 58315
+    # entries collected in memory before they are flushed to a run
+    run_size = 500000
+
+    def __init__(self, path, bookname=None, compress=True, offsetbits=32,
+                 sametypesequence='x', level=6, workers=None,
+                 chunk_size=None, run_size=None, **info):
+        if offsetbits not in (32, 64):
+            raise ValueError('offsetbits must be 32 or 64')
+        self.path = path
+        self.info = dict(bookname=bookname or os.path.basename(path),
+                         sametypesequence=sametypesequence, **info)
+        self.compress = compress
+        self.offsetbits = offsetbits
+        self.level = level
+        self.workers = workers
+        if chunk_size:
+            self.chunk_size = chunk_size
+        if run_size:
+            self.run_size = run_size
+        self.tmpdir = tempfile.mkdtemp(prefix='sdwrite',
+                                       dir=os.path.dirname(os.path.abspath(path)))
+        self.dictf = open(os.path.join(self.tmpdir, 'dict'), 'wb')
+        self.offset = 0
+        self.entries = []
+        self.runs = []
+        self.count = 0
+
+    def add(self, word, definition):
+        'adds headword with its definition (str or bytes)'
+        w = word.encode('utf8')
+        if not w or b'\0' in w or len(w) > 255:
+            raise ValueError('invalid headword: '+repr(word))
+        if isinstance(definition, str):
+            definition = definition.encode('utf8')
+        if self.offsetbits == 32 and self.offset+len(definition) > 0xffffffff:
+            raise ValueError('.dict over 4 GiB, use offsetbits=64')
+        self.dictf.write(definition)
+        self.entries.append((w.lower(), w, self.count, self.offset, len(definition)))
+        self.offset += len(definition)
+        self.count += 1
+        if len(self.entries) >= self.run_size:
+            self._flush()
+
+    def add_all(self, pairs):
+        for word, definition in pairs:
+            self.add(word, definition)
+
+    def _flush(self):
+        self.entries.sort()
+        name = os.path.join(self.tmpdir, 'run%d' % len(self.runs))
+        with open(name, 'wb') as f:
+            _write_run(self.entries, f)
+        self.runs.append(name)
+        self.entries = []
+
+    def _sorted(self, files):
+        'all entries in StarDict order'
+        self.entries.sort()
+        if not files:
+            return iter(self.entries)
+        return heapq.merge(self.entries, *[_read_run(f) for f in files])
+
+    def _write_idx(self):
+        link = struct.Struct('>QL' if self.offsetbits == 64 else '>LL')
+        tmp = os.path.join(self.tmpdir, 'idx')
+        files = [open(r, 'rb') for r in self.runs]
+        try:
+            with open(tmp, 'wb') as f:
+                for key, word, seq, offset, size in self._sorted(files):
+                    f.write(word+b'\0'+link.pack(offset, size))
+        finally:
+            for r in files:
+                r.close()
+        size = os.path.getsize(tmp)
+        os.replace(tmp, self.path+'.idx')
+        return size
+
+    def _write_dict(self):
+        name = os.path.join(self.tmpdir, 'dict')
+        if self.compress:
+            write_dictzip(name, self.path+'.dict.dz', self.chunk_size,
+                          self.level, self.workers)
+            stale = self.path+'.dict'
+        else:
+            os.replace(name, self.path+'.dict')
+            stale = self.path+'.dict.dz'
+        # StarDict would open the other one of them
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    def _write_ifo(self, idxsize):
+        ifo = self.path+'.ifo'
+        lines = ["StarDict's dict ifo file",
+                 'version=%s' % ('3.0.0' if self.offsetbits == 64 else '2.4.2'),
+                 'bookname=%s' % self.info.pop('bookname'),
+                 'wordcount=%d' % self.count,
+                 'idxfilesize=%d' % idxsize]
+        if self.offsetbits == 64:
+            lines.append('idxoffsetbits=64')
+        lines += ['%s=%s' % (k, v) for k, v in self.info.items()]
+        with open(ifo+'.tmp', 'w', encoding='utf8', newline='\n') as f:
+            f.write('\n'.join(lines)+'\n')
+        os.replace(ifo+'.tmp', ifo)
+        return ifo
+
+    def close(self):
+        '''
+        writes .idx and .dict[.dz] and finally .ifo,
+        returns the path of .ifo
+        '''
+        try:
+            self.dictf.close()
+            idxsize = self._write_idx()
+            self._write_dict()
+            return self._write_ifo(idxsize)
+        finally:
+            self.abort()
+
+    def abort(self):
+        'throws away everything written so far'
+        if not self.dictf.closed:
+            self.dictf.close()
+        self.entries = []
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write(path, pairs, **kw):
+    '''
+    writes (headword, definition) pairs as dictionary path,
+    see Writer for keyword arguments, returns path of .ifo
+    '''
+    w = Writer(path, **kw)
+    try:
+        w.add_all(pairs)
+    except BaseException:
+        w.abort()
+        raise
+    return w.close()
+
+
+def _stardict_pairs(ifo):
+    d = sdict.StarDict(ifo)
+    try:
+        for i, data in d.iter_data():
+            yield d[i], data
+    finally:
+        d.unload()
+
+
+def _tab_pairs(name):
+    with open(name, encoding='utf8') as f:
+        for l in f:
+            word, sep, definition = l.rstrip('\n').partition('\t')
+            if sep:
+                yield word, definition.replace('\\n', '\n')
+
+
+if __name__ == '__main__':
+
+    source, target = sys.argv[1:3]
+    if source.endswith('.ifo'):
+        info = sdict.StarDict(source, False).ifo
+        kw = {k: v for k, v in info.items()
+              if k in ('bookname', 'author', 'email', 'website', 'description',
+                       'date', 'sametypesequence')}
+        pairs = _stardict_pairs(source)
+    else:
+        kw = {}
+        pairs = _tab_pairs(source)
+    t = time.time()
+    print(write(target, pairs, **kw), 'written in %.1f s' % (time.time()-t))